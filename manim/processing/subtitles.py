@@ -1,91 +1,204 @@
+import atexit
+import hashlib
 import os
-import queue
 import re
+import shutil
+import struct
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-import ffmpeg
-import matplotlib.pyplot as plt
-from PIL import Image
+LATEX_PREAMBLE = r"\documentclass[preview,border=1pt]{standalone}\usepackage{amsmath,amsfonts,amssymb,xcolor}"
 
-plt.rc("text", usetex=True)
-plt.rc(
-    "text.latex",
-    preamble=r"\usepackage{amsmath} \usepackage{amsfonts} \usepackage{amssymb} \usepackage{xcolor}",
+LATEX_CACHE_DIR = "./media/latex_cache"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Render resolution; generate_image_ass scales the ASS bounding box from pixels with it
+LATEX_DPI = 150
+# standalone typesets at 10pt, the subtitles were sized for 14pt formulas (the old matplotlib
+# fontsize), so dvipng magnifies by 14/10 while the bounding box keeps using LATEX_DPI
+LATEX_RENDER_DPI = round(LATEX_DPI * 14 / 10)
+
+pattern = re.compile(r"\$(.+?)\$")
+placeholder = re.compile(r"\$TEMP(\d+)\$")
+
+srt_block = re.compile(r"\n\s*\n")
+srt_timing = re.compile(
+    r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})"
 )
+srt_tag = re.compile(r"<(/?)([biu])>", re.IGNORECASE)
+
+# Same header ffmpeg emits for SRT -> ASS; the image bounding boxes in generate_image_ass are tuned to this PlayRes
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 384
+PlayResY: 288
+ScaledBorderAndShadow: yes
+YCbCr Matrix: None
 
-pattern = r"\$(.+?)\$"
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,16,&Hffffff,&Hffffff,&H0,&H0,0,0,0,0,100,100,0,0,1,1,0,2,10,10,10,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
 
 
 def convert_srt_to_ass(input_srt_path, output_ass_path):
     """
-    Scan the .srt file for any LaTeX, temporarily replace LaTeX with placeholder, then convert to a temporary .ass file. Then, insert the LaTeX back into the output .ass file.
+    Scan the .srt file for any LaTeX, temporarily replace LaTeX with placeholder, then convert to .ass in memory. Then, insert the LaTeX back and write the output .ass file.
     """
-    latex = queue.Queue()
+    latex = []
     with open(input_srt_path, "r", encoding="utf-8") as file:
         content = file.read()
 
     def replace_expression(match):
-        original = match.group(0)
-        latex.put(original)
-        return "$temp$"
+        latex.append(match.group(0))
+        return f"$TEMP{len(latex) - 1}$"
 
-    modified_file = re.sub(pattern, replace_expression, content)
-    with open("Temp.srt", "w", encoding="utf-8") as file:
+    modified_file = _srt_to_ass(pattern.sub(replace_expression, content))
+    modified_file = placeholder.sub(
+        lambda match: latex[int(match.group(1))], modified_file
+    )
+    if not os.path.exists("./media"):
+        os.makedirs("./media")
+    with open(output_ass_path, "w", encoding="utf-8") as file:
         file.write(modified_file)
 
-    ffmpeg.input("Temp.srt").output("Temp.ass", format="ass").run(overwrite_output=True)
-    with (
-        open("Temp.ass", "r", encoding="utf-8") as source_file,
-        open("Temp2.ass", "w", encoding="utf-8") as destination_file,
-    ):
-        destination_file.write(source_file.read())
 
-    with open("Temp2.ass", "r", encoding="utf-8") as file:
-        content = file.read()
+def _ass_time(hours, minutes, seconds, millis):
+    return f"{int(hours)}:{minutes}:{seconds}.{int(millis) // 10:02d}"
 
-    def replace_expression(match):
-        return latex.get()
 
-    modified_file = re.sub(pattern, replace_expression, content)
-    if not os.path.exists("./media"):
-        os.makedirs("./media")
-    with open(output_ass_path, "w", encoding="utf-8") as file:
-        file.write(modified_file)
+def _ass_tag(match):
+    closing, tag = match.groups()
+    return "{\\" + tag.lower() + ("0" if closing else "1") + "}"
+
 
-    os.remove("Temp.srt")
-    os.remove("Temp.ass")
-    os.remove("Temp2.ass")
+def _srt_to_ass(srt_text):
+    """
+    Translate SRT cues to an ASS script: one Dialogue line per cue, line breaks as \\N and <b>/<i>/<u> as override tags.
+    """
+    dialogues = []
+    for block in srt_block.split(srt_text.replace("\r\n", "\n").strip()):
+        lines = block.split("\n")
+        for idx, line in enumerate(lines):
+            timing = srt_timing.search(line)
+            if timing:
+                break
+        else:
+            continue
+        start = _ass_time(*timing.groups()[:4])
+        end = _ass_time(*timing.groups()[4:])
+        text = srt_tag.sub(_ass_tag, "\\N".join(lines[idx + 1 :]))
+        dialogues.append(f"Dialogue: 0,{start},{end},Default,,0,0,0,,{text}\n")
+    return ASS_HEADER + "".join(dialogues)
 
 
 def process_latex_from_ass(input_ass, output_ass_path):
     """
-    Parse the LaTeX from the input .ass file, create transparent images for each LaTeX expression, and insert the images into the output .ass file.
+    Parse the LaTeX from the input .ass file, create transparent images for each LaTeX expression in parallel, and insert the images into the output .ass file.
+    Images are cached by content hash, so every distinct expression is rendered at most once across matches and runs.
     """
     with open(input_ass, "r", encoding="utf-8") as file:
         content = file.read()
 
-    match_counter = 0
-
-    def replace_expression(match):
-        original = match.group(0)
-        raw_latex = original[1:-1]
-        nonlocal match_counter
-        match_counter += 1
-        return generate_image_ass(raw_latex, match_counter)
+    os.makedirs(LATEX_CACHE_DIR, exist_ok=True)
+    matches = list(pattern.finditer(content))
+    snippets = dict.fromkeys(match.group(1) for match in matches)
+    sizes = {raw: _cached_size(raw) for raw in snippets}
+    missing = [raw for raw, size in sizes.items() if size is None]
+    if missing:
+        workers = min(os.cpu_count() or 1, len(missing))
+        # the workers' scratch directories live under one root that is removed here once the
+        # pool has shut down (atexit handlers don't run when pool workers exit)
+        scratch_root = tempfile.mkdtemp(prefix="latex_")
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(scratch_root,)
+            ) as pool:
+                sizes.update(zip(missing, pool.map(_render, missing)))
+        finally:
+            shutil.rmtree(scratch_root, ignore_errors=True)
 
-    modified_file = re.sub(pattern, replace_expression, content)
+    # Splice the image tags between the untouched spans of the original text
+    chunks = []
+    last = 0
+    for match_counter, match in enumerate(matches, start=1):
+        raw_latex = match.group(1)
+        png_path = _png_path(match_counter)
+        _link_from_cache(raw_latex, png_path)
+        chunks.append(content[last : match.start()])
+        chunks.append(generate_image_ass(png_path, *sizes[raw_latex]))
+        last = match.end()
+    chunks.append(content[last:])
+    modified_file = "".join(chunks)
 
     with open(output_ass_path, "w", encoding="utf-8") as file:
         file.write(modified_file)
 
 
-def generate_image_ass(raw_latex, match_counter):
-    png_path = "./media/" + str(match_counter) + ".png"
-    print(png_path, raw_latex)
-    latex_to_transparent_image(raw_latex, png_path)
-    with Image.open(png_path) as img:
-        width, height = img.size
-    bounding_box_width = round(width / 5, 2)
-    bounding_box_height = round(height / 3.75, 2)
+def _png_path(match_counter):
+    return "./media/" + str(match_counter) + ".png"
+
+
+def _cache_path(raw_latex):
+    """
+    Cache location of the rendered PNG for an expression.
+    """
+    # the DPI is part of the key so images rendered at another resolution are never reused
+    key = f"{LATEX_RENDER_DPI}:{raw_latex}".encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=16).hexdigest()
+    return os.path.join(LATEX_CACHE_DIR, digest + ".png")
+
+
+def _png_size(png_path):
+    """
+    Read (width, height) straight from the PNG's IHDR chunk instead of opening the image.
+    """
+    with open(png_path, "rb") as file:
+        header = file.read(24)
+    if len(header) < 24 or not header.startswith(PNG_SIGNATURE):
+        raise ValueError(f"{png_path} is not a PNG file")
+    return struct.unpack(">II", header[16:24])
+
+
+def _cached_size(raw_latex):
+    cache_path = _cache_path(raw_latex)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        return _png_size(cache_path)
+    except (OSError, ValueError):
+        return None
+
+
+def _render(raw_latex):
+    """
+    Worker entry point: render one LaTeX expression into the cache and return the (width, height) of the PNG.
+    """
+    cache_path = _cache_path(raw_latex)
+    print(cache_path, raw_latex)
+    # render next to the cache entry and move it in place, so an interrupted render is never treated as a hit
+    partial_path = cache_path[: -len(".png")] + ".partial.png"
+    latex_to_transparent_image(raw_latex, partial_path)
+    os.replace(partial_path, cache_path)
+    return _png_size(cache_path)
+
+
+def _link_from_cache(raw_latex, png_path):
+    cache_png = _cache_path(raw_latex)
+    if os.path.exists(png_path):
+        os.remove(png_path)
+    try:
+        os.link(cache_png, png_path)
+    except OSError:
+        shutil.copyfile(cache_png, png_path)
+
+
+def generate_image_ass(png_path, width, height):
+    bounding_box_width = round(width / (LATEX_DPI / 60), 2)
+    bounding_box_height = round(height / (LATEX_DPI / 80), 2)
     downshift = min(round(bounding_box_height / 4, 2), 10)
     bounding_box = f"m 0 {str(downshift)} l {str(bounding_box_width)} {str(downshift)} {str(bounding_box_width)} {str(bounding_box_height + downshift)} 0 {str(bounding_box_height + downshift)} 0 {str(downshift)}"
     return (
@@ -93,31 +206,98 @@ def generate_image_ass(raw_latex, match_counter):
     )
 
 
-def latex_to_transparent_image(latex_code, output_path):
-    fig, ax = plt.subplots()
-    ax.axis("off")
+# Per-process scratch directory and precompiled preamble format (see _ensure_format)
+_workdir = None
+_format = None
+# Parent-owned directory the pool workers create their scratch directories in
+_scratch_root = None
 
-    text = ax.text(
-        0, 0, f"${latex_code}$", fontsize=14, color="white", va="bottom", ha="left"
-    )
 
-    plt.draw()
+def _init_worker(scratch_root):
+    global _scratch_root
+    _scratch_root = scratch_root
+
+
+def _ensure_format():
+    """
+    Dump the shared preamble into a LaTeX format once per process, so each expression only compiles its document body. Returns the format name, or None if it could not be built.
+    """
+    global _workdir, _format
+    if _workdir is None:
+        if _scratch_root is not None:
+            _workdir = tempfile.mkdtemp(prefix="latex_", dir=_scratch_root)
+        else:
+            # called outside the pool: this process cleans up after itself
+            _workdir = tempfile.mkdtemp(prefix="latex_")
+            atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+        preamble_path = os.path.join(_workdir, "preamble.tex")
+        with open(preamble_path, "w", encoding="utf-8") as file:
+            file.write(LATEX_PREAMBLE + r"\dump")
+        result = subprocess.run(
+            [
+                "latex",
+                "-ini",
+                "-interaction=batchmode",
+                "-jobname=preamble",
+                "&latex",
+                "preamble.tex",
+            ],
+            cwd=_workdir,
+            capture_output=True,
+        )
+        _format = "preamble" if result.returncode == 0 else None
+    return _format
+
 
-    bbox = text.get_window_extent()
+def _compile_dvi(tex, extra_args):
+    with open(os.path.join(_workdir, "doc.tex"), "w", encoding="utf-8") as file:
+        file.write(tex)
+    result = subprocess.run(
+        ["latex", "-interaction=batchmode", "-halt-on-error", *extra_args, "doc.tex"],
+        cwd=_workdir,
+        capture_output=True,
+    )
+    return result.returncode == 0
 
-    bbox_inches = bbox.transformed(fig.dpi_scale_trans.inverted())
 
-    fig.set_size_inches(bbox_inches.width, bbox_inches.height)
+def latex_to_transparent_image(latex_code, output_path):
+    """
+    Compile the expression with latex and convert the DVI straight to a tightly cropped, transparent PNG with dvipng.
+    """
+    body = r"\begin{document}\color{white}$" + latex_code + r"$\end{document}"
+    fmt = _ensure_format()
+    # fall back to compiling the full preamble if the dumped format is unavailable or rejects the body
+    if not (fmt and _compile_dvi(body, ["-fmt=" + fmt])):
+        if not _compile_dvi(LATEX_PREAMBLE + body, []):
+            raise RuntimeError(f"latex failed to compile ${latex_code}$")
 
-    plt.savefig(
-        output_path, bbox_inches="tight", pad_inches=0.05, transparent=True, dpi=300
+    subprocess.run(
+        [
+            "dvipng",
+            "-q",
+            "-T",
+            "tight",
+            "-D",
+            str(LATEX_RENDER_DPI),
+            "-bg",
+            "Transparent",
+            "-fg",
+            "rgb 1 1 1",
+            "-o",
+            os.path.abspath(output_path),
+            "doc.dvi",
+        ],
+        cwd=_workdir,
+        check=True,
+        capture_output=True,
     )
-    plt.close()
 
 
 # replace path
 
 # replace file names as appropriate
-convert_srt_to_ass("./media/videos/main/1080p60/Manim_de.srt", "./media/temp.ass")
-process_latex_from_ass("./media/temp.ass", "./media/Manim_de.ass")
-os.remove("./media/temp.ass")
+# (guarded so that worker processes importing this module don't rerun the pipeline)
+if __name__ == "__main__":
+    convert_srt_to_ass("./media/videos/main/1080p60/Manim_de.srt", "./media/temp.ass")
+    process_latex_from_ass("./media/temp.ass", "./media/Manim_de.ass")
+    os.remove("./media/temp.ass")
@@ -0,0 +1,31 @@
+# _atomic.py
+# Files that other runs read back (icons, caches, indexes) are written beside their target
+# and moved in place, so a crash or a concurrent writer never leaves a partial file behind.
+
+import contextlib
+import os
+import threading
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """
+    Yield a scratch path next to `path` to write to; on success it replaces `path`,
+    on failure it is removed and `path` is left untouched.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Replace the contents of `path` with `data` (see atomic_path).
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
@@ -0,0 +1,31 @@
+# _executor.py
+# One bounded thread pool shared by the tools' concurrent network calls (icons, downloads),
+# instead of each call spinning up and tearing down its own executor.
+
+import atexit
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_TOOL_WORKERS = int(os.getenv("VISO_MAX_WORKERS", "8"))
+
+POOL = ThreadPoolExecutor(max_workers=MAX_TOOL_WORKERS, thread_name_prefix="viso")
+atexit.register(POOL.shutdown)
+
+
+def submit_in_context(fn, *args) -> Future:
+    """
+    POOL.submit(fn, *args), run in a copy of the caller's context (see map_in_context).
+    """
+    return POOL.submit(contextvars.copy_context().run, fn, *args)
+
+
+def map_in_context(fn, *iterables) -> list:
+    """
+    Like list(POOL.map(fn, *iterables)), but every job runs in a copy of the caller's
+    context, so context variables (e.g. the Gradio session that captures print output)
+    carry over into the pool threads. Don't call it from a job already running on POOL.
+    """
+    ctx = contextvars.copy_context()
+    futures = [POOL.submit(ctx.copy().run, fn, *args) for args in zip(*iterables)]
+    return [future.result() for future in futures]
@@ -0,0 +1,11 @@
+# _http.py
+# HTTP/2 support shared by the httpx clients (model API, icon inference): with it, concurrent
+# calls share one TLS connection; otherwise they use pooled HTTP/1.1 keep-alive.
+
+# Optional: httpx needs the h2 package for HTTP/2
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
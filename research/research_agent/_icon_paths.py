@@ -0,0 +1,32 @@
+# _icon_paths.py
+# Where the icon tools (Hugging Face and ModelScope) keep generated icons: one file per
+# model/concept/style/context, so a repeated request reuses the icon on disk.
+
+import hashlib
+
+ICON_DIR = "icons"
+
+
+class _FilenameChars(dict):
+    """
+    str.translate table that keeps alphanumerics, space, '-' and '_' and deletes the rest;
+    filled lazily so non-ASCII letters stay allowed without a 0x110000-entry table.
+    """
+
+    def __missing__(self, code: int):
+        ch = chr(code)
+        self[code] = keep = ch if ch.isalnum() or ch in " -_" else None
+        return keep
+
+
+_FILENAME_TABLE = _FilenameChars()
+
+
+def icon_path(model: str, concept: str, style: str, context: str, image_url: str) -> str:
+    """
+    Cache location of an icon: the same model/concept/style/context (and source image) map to the same file.
+    """
+    key = f"{model}|{concept}|{style}|{context}|{image_url or ''}".encode("utf-8")
+    digest = hashlib.sha1(key).hexdigest()[:16]
+    safe = concept.translate(_FILENAME_TABLE).rstrip().replace(" ", "_")
+    return f"{ICON_DIR}/{safe}_{digest}.png"
@@ -1,13 +1,32 @@
 # adapter.py  (updated)
 
+import io
+import sys
+
 from openai import OpenAI
 from smolagents.agents import ChatMessage
 
+# Echo streamed tokens in batches instead of one write+flush per token
+ECHO_FLUSH_TOKENS = 64
+ECHO_FLUSH_CHARS = 512
+
 
 class KimiClientAdapter:
-    def __init__(self, kimi_client: OpenAI, system_prompt: str = None):
+    """
+    Model callable over Kimi's OpenAI-compatible API. It is synchronous on purpose: the tools
+    and the agent are, and concurrent model calls come from the shared tool pool (_executor)
+    using one client, not from an async path.
+    """
+
+    def __init__(
+        self,
+        kimi_client: OpenAI,
+        system_prompt: str = None,
+        model_id: str = "kimi-k2-0711-preview",
+    ):
         self.kimi = kimi_client
         self.system_prompt = system_prompt
+        self.model_id = model_id
 
     def _to_openai_format(self, messages):
         # OpenAI only accepts "system", "user", and "assistant"
@@ -28,20 +47,48 @@ class KimiClientAdapter:
         return converted
 
     def generate(self, messages, **kwargs):
+        # Callers that only read the returned content (e.g. AskClarificationTool) pass echo=False
+        echo = kwargs.pop("echo", True)
         openai_messages = self._to_openai_format(messages)
         response = self.kimi.chat.completions.create(
-            model="kimi-k2-0711-preview",
+            model=self.model_id,
             messages=openai_messages,
             stream=True,
             **{k: v for k, v in kwargs.items() if k in {"temperature", "max_tokens"}},
         )
         collected = []
+        buf = io.StringIO()
+        pending = 0
         for chunk in response:
             delta = chunk.choices[0].delta
             if delta.content:
                 collected.append(delta.content)
-                print(delta.content, end="", flush=True)
+                if echo:
+                    buf.write(delta.content)
+                    pending += 1
+                    if pending >= ECHO_FLUSH_TOKENS or buf.tell() > ECHO_FLUSH_CHARS:
+                        self._flush_echo(buf)
+                        pending = 0
+        self._flush_echo(buf)
         full_text = "".join(collected)
         return ChatMessage(role="assistant", content=full_text)
 
+    def warmup(self):
+        """
+        Open the (kept-alive) connection to the API ahead of the first request, e.g. while the
+        user is still typing; failures are left for the real request to report.
+        """
+        try:
+            self.kimi.models.list()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _flush_echo(buf: io.StringIO):
+        if buf.tell():
+            sys.stdout.write(buf.getvalue())
+            sys.stdout.flush()
+            buf.seek(0)
+            buf.truncate()
+
     __call__ = generate
@@ -1,8 +1,117 @@
-import xml.etree.ElementTree as ET
+import functools
+import re
 
 import requests
+from requests.adapters import HTTPAdapter
 from smolagents import Tool
 
+# Optional: lxml's C parser; the stdlib iterparse has the same streaming interface
+try:
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+ATOM_ENTRY = ATOM + "entry"
+ATOM_AUTHOR = ATOM + "author"
+ATOM_NAME = ATOM + "name"
+# Child tag -> output field for the single-valued entry fields
+ENTRY_FIELDS = {
+    ATOM + "title": "title",
+    ATOM + "summary": "summary",
+    ATOM + "id": "link",
+}
+
+# Shared keep-alive session so repeated searches reuse the connection to export.arxiv.org
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+
+def _split_keywords(keywords):
+    """
+    Single words are matched against the query's tokens, multi-word phrases by substring.
+    """
+    words = frozenset(k for k in keywords if " " not in k)
+    phrases = tuple(k for k in keywords if " " in k)
+    return words, phrases
+
+
+# Define keyword categories
+TIME_WORDS, TIME_PHRASES = _split_keywords(
+    [
+        "latest",
+        "recent",
+        "current",
+        "new",
+        "state-of-the-art",
+        "cutting-edge",
+        "emerging",
+    ]
+)
+QUALITY_WORDS, QUALITY_PHRASES = _split_keywords(
+    [
+        "best",
+        "most important",
+        "seminal",
+        "influential",
+        "foundational",
+        "top",
+        "highly cited",
+        "landmark",
+        "groundbreaking",
+        "classic",
+    ]
+)
+QUERY_TOKEN = re.compile(r"[\w-]+")
+
+
+@functools.lru_cache(maxsize=256)
+def _classify_query(query_lower: str):
+    """
+    Returns (is_time_focused, is_quality_focused) for a lowercased query.
+    """
+    tokens = set(QUERY_TOKEN.findall(query_lower))
+    is_time = not TIME_WORDS.isdisjoint(tokens) or any(
+        p in query_lower for p in TIME_PHRASES
+    )
+    is_quality = not QUALITY_WORDS.isdisjoint(tokens) or any(
+        p in query_lower for p in QUALITY_PHRASES
+    )
+    return is_time, is_quality
+
+
+class _HeadRecorder:
+    """
+    File-like wrapper around a streamed response body that keeps the first bytes read,
+    so the debug preview survives the parser consuming the stream.
+    """
+
+    def __init__(self, raw, limit: int = 512):
+        self.raw = raw
+        self.limit = limit
+        self.head = b""
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        if len(self.head) < self.limit:
+            self.head += data[: self.limit - len(self.head)]
+        return data
+
+
+def _parse_entry(entry) -> dict:
+    """
+    Collect title, authors, summary and link from an ATOM <entry> in one pass over its children.
+    """
+    paper = {"title": "", "authors": [], "summary": "", "link": ""}
+    for child in entry:
+        if child.tag == ATOM_AUTHOR:
+            paper["authors"].append(child.findtext(ATOM_NAME))
+        elif child.tag in ENTRY_FIELDS:
+            text = (child.text or "").strip().replace("\n", " ")
+            paper[ENTRY_FIELDS[child.tag]] = text
+    return paper
+
 
 class ArxivTool(Tool):
     name = "arxiv_search"
@@ -47,34 +156,8 @@ class ArxivTool(Tool):
         """
         # Smart sorting and query enhancement based on intent
         enhanced_query = query
-        query_lower = query.lower()
-
-        # Define keyword categories
-        time_keywords = [
-            "latest",
-            "recent",
-            "current",
-            "new",
-            "state-of-the-art",
-            "cutting-edge",
-            "emerging",
-        ]
-        quality_keywords = [
-            "best",
-            "most important",
-            "seminal",
-            "influential",
-            "foundational",
-            "top",
-            "highly cited",
-            "landmark",
-            "groundbreaking",
-            "classic",
-        ]
-
         # Determine search intent and sorting strategy
-        is_time_focused = any(keyword in query_lower for keyword in time_keywords)
-        is_quality_focused = any(keyword in query_lower for keyword in quality_keywords)
+        is_time_focused, is_quality_focused = _classify_query(query.lower())
 
         # Smart sorting selection
         if is_quality_focused and not is_time_focused:
@@ -103,29 +186,24 @@ class ArxivTool(Tool):
             "sortBy": sort_by,
             "sortOrder": sort_order,
         }
-        response = requests.get(base_url, params=params, timeout=10)
+        response = _SESSION.get(base_url, params=params, timeout=10, stream=True)
         response.raise_for_status()
-        raw_xml = response.text
 
         # Track query modifications and sorting strategy
         query_enhanced = enhanced_query != query
         sorting_info = f"Sorted by: {sort_reason}"
 
-        root = ET.fromstring(raw_xml)
-        ns = {"atom": "http://www.w3.org/2005/Atom"}
-
+        # Parse entries as they arrive and free each subtree once its fields are read
+        response.raw.decode_content = True
+        source = _HeadRecorder(response.raw)
         entries = []
-        for entry in root.findall("atom:entry", ns):
-            title = entry.find("atom:title", ns).text.strip().replace("\n", " ")
-            authors = [
-                author.find("atom:name", ns).text
-                for author in entry.findall("atom:author", ns)
-            ]
-            summary = entry.find("atom:summary", ns).text.strip().replace("\n", " ")
-            link = entry.find("atom:id", ns).text.strip()
-            entries.append(
-                {"title": title, "authors": authors, "summary": summary, "link": link}
-            )
+        with response:
+            for _, entry in iterparse(source, events=("end",)):
+                if entry.tag != ATOM_ENTRY:
+                    continue
+                entries.append(_parse_entry(entry))
+                entry.clear()
+        raw_xml = source.head.decode("utf-8", errors="replace")
 
         if not entries:
             result = "No results found on arXiv for your query."
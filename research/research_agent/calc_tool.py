@@ -1,8 +1,32 @@
 # calc_tool.py
 
+import functools
+
 import sympy as sp
 from smolagents import Tool
 
+# Built once and passed to sympify so every call binds these names to the same Symbols
+_SYMS = dict(zip("xyzu", sp.symbols("x y z u")))
+
+
+@functools.lru_cache(maxsize=256)
+def _evaluate(expression: str) -> str:
+    """
+    Parse and evaluate one expression; memoized because agents often retry identical input.
+    """
+    try:
+        expr = sp.sympify(expression, locals=_SYMS)
+    except (sp.SympifyError, TypeError):
+        return (
+            "Error: could not parse expression. "
+            "Use a single‑line SymPy string, e.g., `integrate(x**2, (x,0,1))`."
+        )
+
+    result = expr.doit() if hasattr(expr, "doit") else expr
+    latex_in = sp.latex(expr)
+    latex_out = sp.latex(result)
+    return f"Input: $$ {latex_in} $$\nResult: $$ {latex_out} $$"
+
 
 class SympyTool(Tool):
     name = "sympy"
@@ -31,16 +55,4 @@ class SympyTool(Tool):
     output_type = "string"
 
     def forward(self, expression: str) -> str:
-        x, y, z, u = sp.symbols("x y z u")
-        try:
-            expr = sp.sympify(expression)
-        except (sp.SympifyError, TypeError):
-            return (
-                "Error: could not parse expression. "
-                "Use a single‑line SymPy string, e.g., `integrate(x**2, (x,0,1))`."
-            )
-
-        result = expr.doit() if hasattr(expr, "doit") else expr
-        latex_in = sp.latex(expr)
-        latex_out = sp.latex(result)
-        return f"Input: $$ {latex_in} $$\nResult: $$ {latex_out} $$"
+        return _evaluate(expression)
@@ -1,10 +1,154 @@
 # code_analysis_tool.py - FIXED VERSION
 
+import ast
+import codecs
+import mmap
 import os
+import re
+from types import MappingProxyType
 
+from llm_cache import cached_model_call
 from smolagents import Tool
 from smolagents.agents import ChatMessage
 
+# Optional: charset detection for files that are not UTF-8
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+# File extension -> language name shown to the model
+LANGUAGE_MAP = MappingProxyType(
+    {
+        ".py": "Python",
+        ".js": "JavaScript",
+        ".ts": "TypeScript",
+        ".java": "Java",
+        ".cpp": "C++",
+        ".c": "C",
+        ".cs": "C#",
+        ".go": "Go",
+        ".rs": "Rust",
+        ".php": "PHP",
+        ".rb": "Ruby",
+        ".swift": "Swift",
+        ".kt": "Kotlin",
+        ".scala": "Scala",
+        ".r": "R",
+        ".m": "MATLAB",
+        ".sql": "SQL",
+        ".sh": "Shell Script",
+        ".html": "HTML",
+        ".css": "CSS",
+    }
+)
+
+# Bytes fed to charset detection; the head of a source file is representative of the rest
+DETECTION_SAMPLE_SIZE = 65536
+# Files above MMAP_THRESHOLD are decoded straight from a memory map; above MAX_BYTES they are refused
+MMAP_THRESHOLD = 65536
+MAX_BYTES = 2_000_000
+
+
+def _decode_source(raw, sample_size: int = DETECTION_SAMPLE_SIZE):
+    """
+    Decode file contents (bytes or an mmap) read once: ASCII/UTF-8 fast paths, then charset
+    detection on the first `sample_size` bytes (the whole file if falsy), then latin1
+    (which never fails). Returns (text, encoding).
+    """
+    if isinstance(raw, bytes) and raw.isascii():
+        return raw.decode("ascii"), "utf-8"
+    has_bom = raw[: len(codecs.BOM_UTF8)] == codecs.BOM_UTF8
+    try:
+        if has_bom:
+            with memoryview(raw) as view:
+                return str(view[len(codecs.BOM_UTF8) :], "utf-8"), "utf-8-sig"
+        return str(raw, "utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        best = from_bytes(raw[:sample_size] if sample_size else raw[:]).best()
+        if best is not None:
+            try:
+                return str(raw, best.encoding), best.encoding
+            except UnicodeDecodeError:
+                # the sample missed bytes that don't fit its guess (mixed encodings)
+                pass
+    return str(raw, "latin1"), "latin1"
+
+
+# Files longer than this are excerpted before they go into the prompt
+MAX_PROMPT_CHARS = 32_000
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _python_excerpt(code: str, question: str, limit: int):
+    """
+    Keep the top-level functions/classes that mention an identifier from the question
+    which the file itself defines. Returns None if nothing relevant fits.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    defined = {
+        node.name
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    }
+    wanted = set(IDENTIFIER.findall(question)) & defined
+    if not wanted:
+        return None
+
+    lines = code.splitlines(keepends=True)
+    parts, total = [], 0
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+        segment = "".join(lines[start : node.end_lineno])
+        if wanted.isdisjoint(IDENTIFIER.findall(segment)):
+            continue
+        if total + len(segment) > limit:
+            break
+        parts.append(f"# (lines {start + 1}-{node.end_lineno})\n{segment}")
+        total += len(segment)
+    return "\n".join(parts) or None
+
+
+def _excerpt_source(
+    code: str, language: str, question: str, limit: int = MAX_PROMPT_CHARS
+):
+    """
+    Return (text, excerpted): the code itself if small enough, otherwise the definitions
+    relevant to the question (Python) or the head and tail of the file.
+    """
+    if len(code) <= limit:
+        return code, False
+    if language == "Python":
+        excerpt = _python_excerpt(code, question, limit)
+        if excerpt:
+            return excerpt, True
+    half = limit // 2
+    elided = len(code) - 2 * half
+    return f"{code[:half]}\n(… {elided} characters elided …)\n{code[-half:]}", True
+
+
+CODE_ANALYSIS_SYSTEM = ChatMessage(
+    role="system",
+    content=(
+        "You are an expert code analyst and educator. "
+        "Analyze the provided code thoroughly and answer the user's question with clear, "
+        "detailed explanations. Focus on:\n"
+        "- Code functionality and logic\n"
+        "- Algorithm explanations\n"
+        "- Best practices and potential improvements\n"
+        "- Educational insights about the code concepts\n"
+        "- Step-by-step breakdowns when helpful\n"
+        "Always provide concrete examples and be pedagogical in your explanations."
+    ),
+)
+
 
 class CodeAnalysisTool(Tool):
     name = "code_analysis"
@@ -24,9 +168,11 @@ class CodeAnalysisTool(Tool):
     }
     output_type = "string"
 
-    def __init__(self, model):
+    def __init__(self, model, sample_size: int = DETECTION_SAMPLE_SIZE):
         super().__init__()
         self.model = model
+        # 0/None runs encoding detection over the whole file (mixed-encoding files)
+        self.sample_size = sample_size
 
     def forward(self, file_path: str, question: str) -> str:
         """
@@ -35,10 +181,7 @@ class CodeAnalysisTool(Tool):
         try:
             # Clean and normalize the file path
             # Remove surrounding quotes if present
-            if (file_path.startswith('"') and file_path.endswith('"')) or (
-                file_path.startswith("'") and file_path.endswith("'")
-            ):
-                file_path = file_path[1:-1]
+            file_path = file_path.strip("\"'")
 
             # Normalize the path for the current OS
             file_path = os.path.normpath(file_path)
@@ -48,78 +191,44 @@ class CodeAnalysisTool(Tool):
                 abs_path = os.path.abspath(file_path)
                 return f"Error: File '{file_path}' not found.\nLooked for: {abs_path}\nPlease check the file path."
 
-            # Try to read the file with different encodings (common on Windows)
-            encodings = ["utf-8", "utf-8-sig", "latin1", "cp1252"]
-            code_content = None
-            used_encoding = None
+            size = os.path.getsize(file_path)
+            if size > MAX_BYTES:
+                return (
+                    f"Error: File '{file_path}' is too large ({size} bytes, limit {MAX_BYTES}). "
+                    "Please pass a smaller file or an excerpt."
+                )
 
-            for encoding in encodings:
-                try:
-                    with open(file_path, "r", encoding=encoding) as f:
-                        code_content = f.read()
-                        used_encoding = encoding
-                        break
-                except UnicodeDecodeError:
-                    continue
-
-            if code_content is None:
-                return f"Error: Could not read file '{file_path}'. File may be binary or use an unsupported encoding."
+            # Read the bytes once and decode them once (files are often non-UTF-8 on Windows);
+            # larger files are decoded from a memory map instead of a copied bytes buffer
+            with open(file_path, "rb") as f:
+                if size > MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        code_content, used_encoding = _decode_source(mm, self.sample_size)
+                else:
+                    code_content, used_encoding = _decode_source(f.read(), self.sample_size)
 
             if not code_content.strip():
                 return f"Error: File '{file_path}' is empty."
 
             # Detect file type/language
             file_extension = os.path.splitext(file_path)[1].lower()
-            language_map = {
-                ".py": "Python",
-                ".js": "JavaScript",
-                ".ts": "TypeScript",
-                ".java": "Java",
-                ".cpp": "C++",
-                ".c": "C",
-                ".cs": "C#",
-                ".go": "Go",
-                ".rs": "Rust",
-                ".php": "PHP",
-                ".rb": "Ruby",
-                ".swift": "Swift",
-                ".kt": "Kotlin",
-                ".scala": "Scala",
-                ".r": "R",
-                ".m": "MATLAB",
-                ".sql": "SQL",
-                ".sh": "Shell Script",
-                ".html": "HTML",
-                ".css": "CSS",
-            }
-
-            detected_language = language_map.get(file_extension, "Unknown")
-
-            # Create system prompt for code analysis
-            system = ChatMessage(
-                role="system",
-                content=(
-                    "You are an expert code analyst and educator. "
-                    "Analyze the provided code thoroughly and answer the user's question with clear, "
-                    "detailed explanations. Focus on:\n"
-                    "- Code functionality and logic\n"
-                    "- Algorithm explanations\n"
-                    "- Best practices and potential improvements\n"
-                    "- Educational insights about the code concepts\n"
-                    "- Step-by-step breakdowns when helpful\n"
-                    "Always provide concrete examples and be pedagogical in your explanations."
-                ),
+            detected_language = LANGUAGE_MAP.get(file_extension, "Unknown")
+
+            # Large files are cut down to what the question needs
+            prompt_code, excerpted = _excerpt_source(
+                code_content, detected_language, question
             )
 
-            # Create analysis prompt
+            # Create analysis prompt; the file header comes first so repeat questions
+            # about the same file share a prompt prefix
             analysis_prompt = (
                 f"FILE: {file_path}\n"
                 f"LANGUAGE: {detected_language}\n"
                 f"FILE SIZE: {len(code_content)} characters\n"
                 f"ENCODING: {used_encoding}\n\n"
-                f"CODE CONTENT:\n"
+                f"CODE CONTENT{' (excerpt)' if excerpted else ''}:\n"
                 f"```{detected_language.lower()}\n"
-                f"{code_content}\n"
+                f"{prompt_code}\n"
                 f"```\n\n"
                 f"USER QUESTION: {question}\n\n"
                 f"Please analyze this {detected_language} code and answer the question thoroughly. "
@@ -130,7 +239,7 @@ class CodeAnalysisTool(Tool):
             user = ChatMessage(role="user", content=analysis_prompt)
 
             # Get analysis from the model
-            response = self.model([system, user])
+            response = cached_model_call(self.model, [CODE_ANALYSIS_SYSTEM, user])
 
             # Format the response with metadata
             formatted_response = (
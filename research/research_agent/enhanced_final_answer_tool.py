@@ -1,8 +1,51 @@
-import json
+import re
+from itertools import islice
 
+import orjson
+from llm_cache import cached_model_call
 from smolagents import Tool
 from smolagents.agents import ChatMessage
 
+# Bullet line in a non-JSON reply: "- concept: caption" (caption optional); lines may end
+# in \n, \r\n or \r and be indented with any whitespace
+BULLET_LINE = re.compile(r"(?:^|(?<=\r))[^\S\r\n]*[-*][^\r\n]*", re.MULTILINE)
+
+# Static prefix (persona + response format), identical on every call so the provider's
+# prompt-prefix cache can reuse it; only the QUESTION/CONTEXT user message varies.
+FINAL_ANSWER_SYSTEM = ChatMessage(
+    role="system",
+    content=(
+        "You are a precise educator channeling a 3Blue1Brown explanation style.\n"
+        "- Write a self-contained explanation in 100–250 words.\n"
+        "- Lead with the core idea, then build intuition using 1–2 concrete visual cues "
+        "(e.g., 'imagine sliding along the curve', 'area under the graph', 'vectors rotating').\n"
+        "- Use stepwise reasoning, tiny examples, and invariants; bring in equations only when they anchor the intuition.\n"
+        "- Avoid fluff and flowery metaphors; keep visuals geometric and operational.\n"
+        "- After the explanation, propose a minimal visual plan: 1–3 concise icon ideas with short captions suitable as thumbnails/diagram elements.\n"
+        "\n"
+        "Respond strictly as JSON with keys:\n"
+        "  - explanation.content  (100–250 words, naturally weaving visual intuition; define any jargon briefly)\n"
+        "  - visual_brief         (array of 1–3 items, each {concept, caption} for icons/diagrams)\n"
+        "Guidelines:\n"
+        "  • Prioritize geometric/graph insight; keep algebra minimal but precise.\n"
+        "  • Use a tiny concrete example if it clarifies the main idea.\n"
+        "  • Keep the visual_brief practical for icon generation (short, specific, no prose blocks).\n"
+    ),
+)
+
+
+def _bullet_brief(raw: str) -> list:
+    """
+    Visual brief from the first three bullet lines of a plain-text reply: the text before the
+    first ':' is the concept, the rest the caption (the whole bullet if there is none).
+    """
+    brief = []
+    for m in islice(BULLET_LINE.finditer(raw), 3):
+        text = m[0].strip("-* ").strip()
+        concept, _, caption = text.partition(":")
+        brief.append({"concept": concept[:40], "caption": (caption or text)[:80]})
+    return brief
+
 
 class Enhanced3Blue1BrownFinalAnswerTool(Tool):
     name = "final_answer"
@@ -21,34 +64,11 @@ class Enhanced3Blue1BrownFinalAnswerTool(Tool):
         self.model = model
 
     def forward(self, question: str, result: str) -> str:
-        system = ChatMessage(
-            role="system",
-            content=(
-                "You are a precise educator channeling a 3Blue1Brown explanation style.\n"
-                "- Write a self-contained explanation in 100–250 words.\n"
-                "- Lead with the core idea, then build intuition using 1–2 concrete visual cues "
-                "(e.g., 'imagine sliding along the curve', 'area under the graph', 'vectors rotating').\n"
-                "- Use stepwise reasoning, tiny examples, and invariants; bring in equations only when they anchor the intuition.\n"
-                "- Avoid fluff and flowery metaphors; keep visuals geometric and operational.\n"
-                "- After the explanation, propose a minimal visual plan: 1–3 concise icon ideas with short captions suitable as thumbnails/diagram elements.\n"
-            ),
-        )
-
         user = ChatMessage(
             role="user",
-            content=(
-                f"QUESTION:\n{question}\n\n"
-                f"CONTEXT FROM TOOLS:\n{result}\n\n"
-                "Respond strictly as JSON with keys:\n"
-                "  - explanation.content  (100–250 words, naturally weaving visual intuition; define any jargon briefly)\n"
-                "  - visual_brief         (array of 1–3 items, each {concept, caption} for icons/diagrams)\n"
-                "Guidelines:\n"
-                "  • Prioritize geometric/graph insight; keep algebra minimal but precise.\n"
-                "  • Use a tiny concrete example if it clarifies the main idea.\n"
-                "  • Keep the visual_brief practical for icon generation (short, specific, no prose blocks).\n"
-            ),
+            content=f"QUESTION:\n{question}\n\nCONTEXT FROM TOOLS:\n{result}\n",
         )
-        resp = self.model([system, user])
+        resp = cached_model_call(self.model, [FINAL_ANSWER_SYSTEM, user])
         raw = (resp.content or "").strip()
 
         # Try to parse JSON straight from the model (robust fallback below)
@@ -56,7 +76,7 @@ class Enhanced3Blue1BrownFinalAnswerTool(Tool):
         visual_brief = []
 
         try:
-            obj = json.loads(raw)
+            obj = orjson.loads(raw)
             explanation = (obj.get("explanation", {}) or {}).get("content", "") or ""
             vb = obj.get("visual_brief", []) or []
             if isinstance(vb, list):
@@ -68,10 +88,8 @@ class Enhanced3Blue1BrownFinalAnswerTool(Tool):
             # Fallback: treat model output as plain text; take first 2–4 sentences,
             # plus a tiny heuristic for bullet lines as concepts.
             explanation = raw.split("\n\n")[0]
-            # Simple extraction of lines starting with '-', '*', or numbered
-            lines = [ln.strip("-* ").strip() for ln in raw.splitlines() if ln.strip().startswith(("-", "*"))]
-            for ln in lines[:3]:
-                visual_brief.append({"concept": ln.split(":")[0][:40], "caption": (":".join(ln.split(":")[1:]) or ln)[:80]})
+            # Simple extraction of lines starting with '-' or '*' ("concept: caption")
+            visual_brief = _bullet_brief(raw)
 
         out = {
             "question": question,
@@ -79,4 +97,4 @@ class Enhanced3Blue1BrownFinalAnswerTool(Tool):
             "visual_brief": visual_brief[:3],
             "visual_assets": {"icons": []},
         }
-        return json.dumps(out, ensure_ascii=False)
+        return orjson.dumps(out).decode()
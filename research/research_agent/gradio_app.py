@@ -1,15 +1,15 @@
 # gradio_app.py
 
+import asyncio
+import contextvars
 import os
-import queue
 import sys
-import threading
 
 import gradio as gr
 
 # Ensure we can import your main.py and its functions
+# (imported on the first request, so the UI is up before the agent stack loads)
 sys.path.insert(0, os.path.dirname(__file__))
-from main import agent, display_welcome
 
 # --- Custom CSS to shrink fonts and tighten layout ---
 custom_css = """
@@ -37,62 +37,98 @@ button {
 """
 
 
-def gradio_stream(question, file_path=""):
-    # Thread-safe queue for printed chunks
-    q = queue.Queue()
+# Sessions whose agent runs may proceed at once (Gradio's default is one event at a time)
+MAX_SESSIONS = int(os.getenv("VISO_MAX_SESSIONS", "4"))
 
-    # Custom stdout catcher to enqueue all print() output
-    class StdoutCatcher:
-        def write(self, txt):
-            if txt:
-                q.put(txt)
+# Writer of the Gradio session whose agent run owns the current context (None outside a run)
+_session_write = contextvars.ContextVar("session_write", default=None)
 
-        def flush(self):
-            pass
 
-    # Monkey-patch stdout so every print goes into our queue
-    old_stdout = sys.stdout
-    sys.stdout = StdoutCatcher()
+class SessionStdout:
+    """
+    stdout proxy that sends print() output to the session running in the current context,
+    so concurrent users don't see each other's logs. Everything else reaches the real stdout.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, txt):
+        write = _session_write.get()
+        if write is None:
+            return self.fallback.write(txt)
+        if txt:
+            write(txt)
+        return len(txt)
+
+    def flush(self):
+        if _session_write.get() is None:
+            self.fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+# Installed once; routing is per context instead of swapping sys.stdout per request
+sys.stdout = SessionStdout(sys.stdout)
+
+
+async def gradio_stream(question, file_path=""):
+    loop = asyncio.get_running_loop()
+    q = asyncio.Queue()
 
     def worker():
-        try:
-            # 1) Print the welcome banner
-            display_welcome()
-
-            # 2) Mirror main.py’s code-path logic for optional file
-            combined = question
-            fp = file_path.strip()
-            if fp:
-                if (fp.startswith("'") and fp.endswith("'")) or (
-                    fp.startswith('"') and fp.endswith('"')
-                ):
-                    fp = fp[1:-1]
-                fp = os.path.normpath(fp)
-                if os.path.exists(fp):
-                    print(f"✅ Found code file: {fp}")
-                    combined = f"Please analyze the code file '{fp}' and answer this question: {question}"
-                else:
-                    print(f"⚠️ File not found: {fp}. Continuing without code.")
-            print("\n🔄 Processing your request...")
-
-            # 3) Run the agent; every print inside goes to our queue
-            agent.run(combined)
-        finally:
-            # Signal completion by sending None, then restore stdout
-            q.put(None)
-            sys.stdout = old_stdout
-
-    # Start the agent in a background thread
-    threading.Thread(target=worker, daemon=True).start()
-
-    # Accumulate and yield the full console output as it grows
+        from main import agent, display_welcome
+
+        # 1) Print the welcome banner
+        display_welcome()
+
+        # 2) Mirror main.py’s code-path logic for optional file
+        combined = question
+        fp = file_path.strip()
+        if fp:
+            if (fp.startswith("'") and fp.endswith("'")) or (
+                fp.startswith('"') and fp.endswith('"')
+            ):
+                fp = fp[1:-1]
+            fp = os.path.normpath(fp)
+            if os.path.exists(fp):
+                print(f"✅ Found code file: {fp}")
+                combined = f"Please analyze the code file '{fp}' and answer this question: {question}"
+            else:
+                print(f"⚠️ File not found: {fp}. Continuing without code.")
+        print("\n🔄 Processing your request...")
+
+        # 3) Run the agent; every print inside goes to our queue
+        agent.run(combined)
+
+    # Run the agent in a worker thread whose context routes stdout into this session's queue
+    ctx = contextvars.copy_context()
+    ctx.run(
+        _session_write.set,
+        lambda txt: loop.call_soon_threadsafe(q.put_nowait, txt),
+    )
+    task = asyncio.ensure_future(asyncio.to_thread(ctx.run, worker))
+    # Signal completion by sending None (queued after every chunk the worker produced)
+    task.add_done_callback(lambda _: q.put_nowait(None))
+
+    # Accumulate the console output; every chunk that queued up while the UI was
+    # busy is folded into a single update instead of re-sending the text per print()
     output = ""
-    while True:
-        chunk = q.get()
-        if chunk is None:
-            break
-        output += chunk
-        yield output
+    done = False
+    while not done:
+        batch = [await q.get()]
+        while not q.empty():
+            batch.append(q.get_nowait())
+        if None in batch:
+            done = True
+            batch = batch[: batch.index(None)]
+        if batch:
+            output += "".join(batch)
+            yield output
+
+    # Surface agent errors to Gradio instead of dropping them with the thread
+    await task
 
 
 # Build the Gradio interface with custom CSS
@@ -109,8 +145,8 @@ demo = gr.Interface(
     allow_flagging="never",
 )
 
-# Enable the generator-based streaming
-demo = demo.queue()
+# Enable the generator-based streaming; sessions run concurrently, each with its own stdout
+demo = demo.queue(default_concurrency_limit=MAX_SESSIONS)
 
 if __name__ == "__main__":
     demo.launch()
@@ -1,24 +1,46 @@
-import json
 import os
+import threading
 import time
+from concurrent.futures import Future
+from functools import partial
 from io import BytesIO
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
 
-import requests
-from PIL import Image, ImageOps
+import httpx
+import orjson
+from _atomic import atomic_path
+from _executor import MAX_TOOL_WORKERS, map_in_context
+from _http import HTTP2_AVAILABLE
+from _icon_paths import icon_path
 from smolagents import Tool
 
+# PIL is only needed once an icon is actually generated; it is imported there so that
+# importing the tool (and starting the agent/UI) doesn't pay for it
+if TYPE_CHECKING:
+    from PIL import Image
 
-def _coerce_concepts(concepts: str) -> List[str]:
+# Icons are shown small; decode and store them at most this size
+ICON_SIZE = (256, 256)
+
+# Sampling parameters per model; schnell is distilled to converge in ~4 steps without guidance
+DEFAULT_PARAMETERS = {"num_inference_steps": 24, "guidance_scale": 3.0}
+MODEL_PARAMETERS = {
+    "black-forest-labs/FLUX.1-schnell": {"num_inference_steps": 4, "guidance_scale": 0.0},
+    "black-forest-labs/FLUX.1-dev": {"num_inference_steps": 20, "guidance_scale": 3.5},
+}
+
+
+def _coerce_concepts(concepts) -> List[str]:
     """
     Accepts:
       - a JSON string with visual_brief: [{"concept": "...", "caption": "..."}]
       - a JSON string list of concepts
       - a comma-separated string
+      - the already parsed dict/list (in-process callers skip the JSON round-trip)
     Returns a flat list of concept strings.
     """
     try:
-        obj = json.loads(concepts)
+        obj = concepts if isinstance(concepts, (dict, list)) else orjson.loads(concepts)
         if isinstance(obj, dict) and "visual_brief" in obj:
             return [
                 item.get("concept", "").strip()
@@ -29,20 +51,21 @@ def _coerce_concepts(concepts: str) -> List[str]:
             return [str(x).strip() for x in obj if str(x).strip()]
     except Exception:
         pass
+    if not isinstance(concepts, str):
+        return []
     # Fallback: comma-separated string
     return [c.strip() for c in concepts.split(",") if c.strip()]
 
 
-def _background_to_transparent(img: Image.Image, light_threshold: int = 245) -> Image.Image:
+def _background_to_transparent(img: "Image.Image", light_threshold: int = 245) -> "Image.Image":
     """
     Convert near-white background to transparent. Works best for flat, minimalist icons.
     """
     if img.mode != "RGBA":
         img = img.convert("RGBA")
-    r, g, b, a = img.split()
-    gray = ImageOps.grayscale(Image.merge("RGB", (r, g, b)))
-    # mask: 255 for 'non-bg' (ink), 0 for bg
-    mask = Image.eval(gray, lambda px: 255 if px < light_threshold else 0)
+    # RGBA -> L uses the same luma weights as ImageOps.grayscale, in one C pass;
+    # mask: 255 for 'non-bg' (ink), 0 for bg, applied as a 256-entry lookup table
+    mask = img.convert("L").point([255 if px < light_threshold else 0 for px in range(256)])
     img.putalpha(mask)
     return img
 
@@ -82,6 +105,12 @@ class IconGenerationTool(Tool):
             "nullable": True,
             "default": None,
         },
+        "ignore_cache": {
+            "type": "boolean",
+            "description": "Regenerate icons even if an identical one was generated before (locally or by the HF inference cache).",
+            "nullable": True,
+            "default": False,
+        },
     }
     output_type = "string"
 
@@ -104,18 +133,39 @@ class IconGenerationTool(Tool):
 
         os.makedirs("icons", exist_ok=True)
         self.base_url = "https://api-inference.huggingface.co/models"
+        # One client shared by the worker threads: kept-alive connections, and with HTTP/2
+        # the concurrent requests are multiplexed over a single TLS connection
+        self.http = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            timeout=90.0,
+            limits=httpx.Limits(max_connections=MAX_TOOL_WORKERS, max_keepalive_connections=MAX_TOOL_WORKERS),
+            headers={"Authorization": f"Bearer {self.hf_token}", "Content-Type": "application/json"},
+        )
+        # Icons being generated right now, by target file: concurrent calls (e.g. two Gradio
+        # sessions) asking for the same icon wait for the one request instead of sending another
+        self._inflight: dict = {}
+        self._inflight_lock = threading.Lock()
+
+    def close(self):
+        self.http.close()
+
+    def __del__(self):
+        http = getattr(self, "http", None)
+        if http is not None:
+            http.close()
 
     # ---------- HTTP helpers ----------
-    def _post_image(self, model_id: str, payload: dict, retries: int = 3, backoff: float = 2.0) -> bytes:
+    def _post_image(
+        self, model_id: str, payload: dict, retries: int = 3, backoff: float = 2.0, use_cache: bool = True
+    ) -> bytes:
         url = f"{self.base_url}/{model_id}"
-        headers = {
-            "Authorization": f"Bearer {self.hf_token}",
-            "Content-Type": "application/json",
-        }
-        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        # orjson writes UTF-8 bytes directly (same output as json.dumps(ensure_ascii=False).encode())
+        data = orjson.dumps(payload)
+        # HF's inference cache answers identical requests without rerunning the model
+        headers = {"x-use-cache": "true" if use_cache else "false"}
 
         for attempt in range(1, retries + 1):
-            resp = requests.post(url, data=data, headers=headers, timeout=90)
+            resp = self.http.post(url, content=data, headers=headers)
             # success returns image bytes directly
             if resp.status_code == 200 and resp.headers.get("content-type", "").startswith("image/"):
                 return resp.content
@@ -136,6 +186,71 @@ class IconGenerationTool(Tool):
             raise RuntimeError(f"HF request failed ({resp.status_code}): {err}")
         raise RuntimeError("HF request failed after retries (rate-limited or cold start).")
 
+    # ---------- Per-concept ----------
+    def _generate_one(
+        self, concept: str, model: str, style: str, context: str, image_url: str, ignore_cache: bool
+    ) -> Optional[dict]:
+        prompt = (
+            f"{concept}. "
+            f"Create a simple, clear educational icon; {style}. "
+            f"Context: {context}. Focus on geometry/shape; avoid text and numbers."
+        )
+        payload = {
+            "inputs": prompt,
+            "parameters": {**DEFAULT_PARAMETERS, **MODEL_PARAMETERS.get(model, {})},
+        }
+        if image_url:
+            payload["image_url"] = image_url
+
+        filename = icon_path(model, concept, style, context, image_url)
+        if not ignore_cache and os.path.exists(filename):
+            print(f"♻️ Icon for '{concept}' reused from {filename}")
+            return {"concept": concept, "filename": filename, "model": model, "prompt": prompt}
+
+        with self._inflight_lock:
+            pending = self._inflight.get(filename)
+            if pending is None:
+                self._inflight[filename] = own = Future()
+        if pending is not None:
+            print(f"⏳ Icon for '{concept}' is already being generated; waiting for it")
+            return pending.result()
+
+        icon = None
+        try:
+            icon = self._create_icon(concept, model, payload, prompt, filename, ignore_cache)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[filename]
+            own.set_result(icon)
+        return icon
+
+    def _create_icon(
+        self, concept: str, model: str, payload: dict, prompt: str, filename: str, ignore_cache: bool
+    ) -> Optional[dict]:
+        try:
+            img_bytes = self._post_image(model, payload, use_cache=not ignore_cache)
+            from PIL import Image
+
+            img = Image.open(BytesIO(img_bytes))
+            img.draft("RGB", ICON_SIZE)  # JPEG: decode directly at a reduced scale
+            img.thumbnail(ICON_SIZE, Image.Resampling.LANCZOS)
+            img = _background_to_transparent(img, light_threshold=245)
+
+            with atomic_path(filename) as tmp_path:
+                img.save(tmp_path, format="PNG", optimize=False, compress_level=1)
+
+            print(f"✅ Icon for '{concept}' saved to {filename}")
+            return {
+                "concept": concept,
+                "filename": filename,
+                "model": model,
+                "prompt": prompt,
+            }
+
+        except Exception as e:
+            print(f"❌ Icon generation failed for '{concept}' on {model}: {e}")
+            return None
+
     # ---------- Main ----------
     def forward(
         self,
@@ -144,9 +259,10 @@ class IconGenerationTool(Tool):
         style: str = None,
         context: str = "",
         image_url: str = None,
+        ignore_cache: bool = False,
     ) -> str:
         """
-        Generate PNG icons for given concepts (or a visual_brief JSON).
+        Generate PNG icons for given concepts (or a visual_brief JSON, or its parsed dict).
         Returns JSON with concept->file mappings and prompts used.
         """
         model = (model_id or "black-forest-labs/FLUX.1-schnell").strip()
@@ -158,54 +274,36 @@ class IconGenerationTool(Tool):
 
         concept_list = _coerce_concepts(concepts)
         if not concept_list:
-            return json.dumps(
-                {"generated_icons": [], "icon_paths": [], "total_generated": 0, "model_used": model},
-                ensure_ascii=False
-            )
+            return orjson.dumps(
+                {"generated_icons": [], "icon_paths": [], "total_generated": 0, "model_used": model}
+            ).decode()
+
+        generate = partial(
+            self._generate_one,
+            model=model,
+            style=style,
+            context=context,
+            image_url=image_url,
+            ignore_cache=bool(ignore_cache),
+        )
+        # Case-insensitive duplicates are generated once and share the icon
+        unique = {}
+        for concept in concept_list:
+            unique.setdefault(concept.lower(), concept)
+        # Concepts are generated concurrently on the shared pool; HF calls are network-bound
+        by_key = dict(zip(unique, map_in_context(generate, unique.values())))
 
+        # back to the requested concepts, in their original order; failed ones are None
         generated_icons = []
-        paths = []
-
-        for idx, concept in enumerate(concept_list, start=1):
-            prompt = (
-                f"{concept}. "
-                f"Create a simple, clear educational icon; {style}. "
-                f"Context: {context}. Focus on geometry/shape; avoid text and numbers."
-            )
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "num_inference_steps": 24,
-                    "guidance_scale": 3.0,
-                }
-            }
-            if image_url:
-                payload["image_url"] = image_url
+        for concept in concept_list:
+            icon = by_key[concept.lower()]
+            if icon:
+                generated_icons.append({**icon, "concept": concept})
+        paths = [icon["filename"] for icon in generated_icons]
 
-            try:
-                img_bytes = self._post_image(model, payload)
-                img = Image.open(BytesIO(img_bytes)).convert("RGBA")
-                img = _background_to_transparent(img, light_threshold=245)
-
-                safe = "".join(ch for ch in concept if ch.isalnum() or ch in (" ", "-", "_")).rstrip()
-                filename = f"icons/{safe.replace(' ', '_')}_icon_{idx}.png"
-                img.save(filename, format="PNG")
-
-                generated_icons.append({
-                    "concept": concept,
-                    "filename": filename,
-                    "model": model,
-                    "prompt": prompt,
-                })
-                paths.append(filename)
-                print(f"✅ Icon for '{concept}' saved to {filename}")
-
-            except Exception as e:
-                print(f"❌ Icon generation failed for '{concept}' on {model}: {e}")
-
-        return json.dumps({
+        return orjson.dumps({
             "generated_icons": generated_icons,
             "icon_paths": paths,
             "total_generated": len(generated_icons),
             "model_used": model,
-        }, indent=2, ensure_ascii=False)
+        }, option=orjson.OPT_INDENT_2).decode()
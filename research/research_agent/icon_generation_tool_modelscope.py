@@ -1,11 +1,20 @@
-import json
 import os
-from io import BytesIO
+import shutil
+import threading
+from functools import partial
+from typing import List, Optional
 
+import orjson
 import requests
-from PIL import Image
+from _atomic import atomic_path
+from _executor import MAX_TOOL_WORKERS, map_in_context
+from _icon_paths import icon_path
+from requests.adapters import HTTPAdapter
 from smolagents import Tool
 
+# Icons are shown small; decode and store them at most this size
+ICON_SIZE = (256, 256)
+
 
 class IconGenerationTool(Tool):
     name = "icon_generation"
@@ -43,6 +52,12 @@ class IconGenerationTool(Tool):
             "nullable": True,
             "default": None,
         },
+        "ignore_cache": {
+            "type": "boolean",
+            "description": "Regenerate icons even if an identical one was generated before",
+            "nullable": True,
+            "default": False,
+        },
     }
     output_type = "string"
 
@@ -54,6 +69,18 @@ class IconGenerationTool(Tool):
         # Updated model and endpoint URL:
         self.base_url = "https://api-inference.modelscope.cn/v1/images/generations"
         self.default_model = "MusePublic/489_ckpt_FLUX_1"
+        # Pooled keep-alive session shared by the worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=MAX_TOOL_WORKERS, pool_maxsize=MAX_TOOL_WORKERS
+        )
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            }
+        )
 
         os.makedirs("icons", exist_ok=True)
 
@@ -64,6 +91,7 @@ class IconGenerationTool(Tool):
         style: str = None,
         context: str = "",
         image_url: str = None,
+        ignore_cache: bool = False,
     ) -> str:
         """
         Generate simple educational icons for the given concepts.
@@ -76,65 +104,55 @@ class IconGenerationTool(Tool):
                 "no text or math symbols, suitable for educational animation"
             )
 
-        concept_list = [c.strip() for c in concepts.split(",") if c.strip()]
-        generated_icons = []
-        icon_paths = []
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        requested = [c.strip() for c in concepts.split(",") if c.strip()]
+        # Case-insensitive duplicates are generated once and share the icon
+        unique = {}
+        for concept in requested:
+            unique.setdefault(concept.lower(), concept)
+        concept_list = list(unique.values())
+        prompts = [self._prompt_for(c, style, context) for c in concept_list]
+        filenames = [
+            icon_path(model_to_use, c, style, context, image_url) for c in concept_list
+        ]
+        results = [None] * len(concept_list)
+        pending = []
+        for i, (concept, filename) in enumerate(zip(concept_list, filenames)):
+            if not ignore_cache and os.path.exists(filename):
+                print(f"♻️ Icon for '{concept}' reused from {filename}")
+                results[i] = self._icon_entry(
+                    concept, filename, model_to_use, prompts[i]
+                )
+            else:
+                pending.append(i)
 
-        for idx, concept in enumerate(concept_list, start=1):
-            prompt_text = (
-                f"Create a simple, clear icon representing '{concept}'. "
-                f"Style: {style}. "
-                f"Background: transparent. "
-                f"Context: {context}. "
-                f"No text, no mathematical symbols."
+        if pending:
+            todo = (
+                [concept_list[i] for i in pending],
+                [prompts[i] for i in pending],
+                [filenames[i] for i in pending],
             )
-            payload = {"model": model_to_use, "prompt": prompt_text}
-            if image_url:
-                payload["image_url"] = image_url
-
-            try:
-                # mirror user’s working pattern with ensure_ascii=False and utf-8 encoding
-                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-                resp = requests.post(
-                    self.base_url, data=data, headers=headers, timeout=120
-                )
-                resp.raise_for_status()
-                images = resp.json().get("images", [])
-                if not images:
-                    print(f"❌ No images returned for '{concept}' using {model_to_use}")
-                    continue
-
-                img_url = images[0].get("url")
-                img_resp = requests.get(img_url, timeout=30)
-                img_resp.raise_for_status()
-                image = Image.open(BytesIO(img_resp.content)).convert("RGBA")
-
-                safe_name = "".join(
-                    ch for ch in concept if ch.isalnum() or ch in (" ", "-", "_")
-                ).rstrip()
-                filename = f"icons/{safe_name.replace(' ', '_')}_icon_{idx}.png"
-                image.save(filename, format="PNG")
-
-                generated_icons.append(
-                    {
-                        "concept": concept,
-                        "filename": filename,
-                        "model": model_to_use,
-                        "prompt": prompt_text,
-                    }
-                )
-                icon_paths.append(filename)
-                print(
-                    f"✅ Icon for '{concept}' saved to {filename} (model: {model_to_use})"
+            # One multi-prompt request when the endpoint accepts it, else one per concept;
+            # either way the downloads run concurrently
+            img_urls = self._generate_batch(todo[1], model_to_use, image_url)
+            if img_urls is None:
+                job = partial(
+                    self._generate_one, model_to_use=model_to_use, image_url=image_url
                 )
+                args = todo
+            else:
+                job = partial(self._download_one, model_to_use=model_to_use)
+                args = (*todo, img_urls)
+            for i, icon in zip(pending, map_in_context(job, *args)):
+                results[i] = icon
 
-            except Exception as err:
-                print(f"❌ Error for '{concept}' with {model_to_use}: {err}")
-                continue
+        # back to the requested concepts, in their original order; failed ones are None
+        by_key = dict(zip(unique, results))
+        generated_icons = []
+        for concept in requested:
+            icon = by_key[concept.lower()]
+            if icon:
+                generated_icons.append({**icon, "concept": concept})
+        icon_paths = [icon["filename"] for icon in generated_icons]
 
         result = {
             "generated_icons": generated_icons,
@@ -142,4 +160,126 @@ class IconGenerationTool(Tool):
             "total_generated": len(generated_icons),
             "model_used": model_to_use,
         }
-        return json.dumps(result, indent=2)
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
+
+    @staticmethod
+    def _icon_entry(
+        concept: str, filename: str, model_to_use: str, prompt_text: str
+    ) -> dict:
+        return {
+            "concept": concept,
+            "filename": filename,
+            "model": model_to_use,
+            "prompt": prompt_text,
+        }
+
+    @staticmethod
+    def _prompt_for(concept: str, style: str, context: str) -> str:
+        return (
+            f"Create a simple, clear icon representing '{concept}'. "
+            f"Style: {style}. "
+            f"Background: transparent. "
+            f"Context: {context}. "
+            f"No text, no mathematical symbols."
+        )
+
+    def _post_generation(self, payload: dict) -> requests.Response:
+        # UTF-8 bytes in one pass, same as json.dumps(ensure_ascii=False).encode("utf-8")
+        data = orjson.dumps(payload)
+        return self.session.post(self.base_url, data=data, timeout=120)
+
+    def _generate_batch(
+        self, prompts: List[str], model_to_use: str, image_url: str
+    ) -> Optional[List[str]]:
+        """
+        Request all prompts in one call; returns image URLs in prompt order, or None
+        when the endpoint doesn't take a prompt list (HTTP 400). Any other failure is
+        raised: the batch may already have been generated (and billed), so it is not
+        requested again one prompt at a time.
+        """
+        if len(prompts) < 2:
+            return None
+        payload = {"model": model_to_use, "prompt": prompts}
+        if image_url:
+            payload["image_url"] = image_url
+        resp = self._post_generation(payload)
+        if resp.status_code == 400:
+            return None
+        resp.raise_for_status()
+        img_urls = [img.get("url") for img in resp.json().get("images", [])]
+        if len(img_urls) != len(prompts) or not all(img_urls):
+            raise ValueError(
+                f"Batched icon request with {model_to_use} returned {len(img_urls)} "
+                f"image(s) for {len(prompts)} prompts"
+            )
+        return img_urls
+
+    def _generate_one(
+        self,
+        concept: str,
+        prompt_text: str,
+        filename: str,
+        model_to_use: str,
+        image_url: str,
+    ) -> Optional[dict]:
+        """
+        Generate, download and save the icon for one concept; None on failure.
+        """
+        payload = {"model": model_to_use, "prompt": prompt_text}
+        if image_url:
+            payload["image_url"] = image_url
+
+        try:
+            resp = self._post_generation(payload)
+            resp.raise_for_status()
+            images = resp.json().get("images", [])
+        except Exception as err:
+            print(f"❌ Error for '{concept}' with {model_to_use}: {err}")
+            return None
+        if not images:
+            print(f"❌ No images returned for '{concept}' using {model_to_use}")
+            return None
+        return self._download_one(
+            concept, prompt_text, filename, images[0].get("url"), model_to_use
+        )
+
+    def _download_one(
+        self,
+        concept: str,
+        prompt_text: str,
+        filename: str,
+        img_url: str,
+        model_to_use: str,
+    ) -> Optional[dict]:
+        # the download streams to a scratch file and PIL decodes from there, so the
+        # encoded image is never held in memory next to the decoded one
+        download_path = f"{filename}.{threading.get_ident()}.download"
+        try:
+            with self.session.get(img_url, stream=True, timeout=30) as img_resp:
+                img_resp.raise_for_status()
+                img_resp.raw.decode_content = True
+                with open(download_path, "wb") as f:
+                    shutil.copyfileobj(img_resp.raw, f, length=65536)
+
+            from PIL import Image  # deferred: only needed once an icon is generated
+
+            with Image.open(download_path) as image:
+                image.draft("RGB", ICON_SIZE)  # JPEG: decode directly at a reduced scale
+                image.thumbnail(ICON_SIZE, Image.Resampling.LANCZOS)
+                if image.mode != "RGBA":
+                    image = image.convert("RGBA")
+
+                with atomic_path(filename) as tmp_path:
+                    image.save(tmp_path, format="PNG", optimize=False, compress_level=1)
+
+            print(
+                f"✅ Icon for '{concept}' saved to {filename} (model: {model_to_use})"
+            )
+            return self._icon_entry(concept, filename, model_to_use, prompt_text)
+
+        except Exception as err:
+            print(f"❌ Error for '{concept}' with {model_to_use}: {err}")
+            return None
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
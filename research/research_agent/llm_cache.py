@@ -0,0 +1,66 @@
+# llm_cache.py
+# Exact-match response cache for deterministic tool prompts:
+# in-process LRU first, then one JSON file per key under ./.llm_cache/ (survives restarts).
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from _atomic import write_atomic
+from smolagents.agents import ChatMessage
+
+CACHE_DIR = ".llm_cache"
+MEMORY_ENTRIES = 256
+
+_memory: "OrderedDict[str, str]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_key(model, messages) -> str:
+    # model_id keeps responses from different models apart
+    model_id = getattr(model, "model_id", type(model).__name__)
+    h = hashlib.blake2b(str(model_id).encode("utf-8"), digest_size=16)
+    for msg in messages:
+        role = getattr(msg.role, "value", msg.role)
+        h.update(b"\x00" + str(role).encode("utf-8"))
+        h.update(b"\x00" + (msg.content or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+def _remember(key: str, content: str):
+    with _lock:
+        _memory[key] = content
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def cached_model_call(model, messages) -> ChatMessage:
+    """
+    Return model(messages), reusing a previous response for the exact same model + messages.
+    """
+    key = _cache_key(model, messages)
+    with _lock:
+        content = _memory.get(key)
+    if content is not None:
+        _remember(key, content)
+        return ChatMessage(role="assistant", content=content)
+
+    path = os.path.join(CACHE_DIR, key + ".json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)["content"]
+    except (OSError, ValueError, KeyError):
+        content = None
+    if content is not None:
+        _remember(key, content)
+        return ChatMessage(role="assistant", content=content)
+
+    response = model(messages)
+    content = response.content or ""
+    _remember(key, content)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_atomic(path, json.dumps({"content": content}, ensure_ascii=False).encode("utf-8"))
+    return response
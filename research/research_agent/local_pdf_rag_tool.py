@@ -2,10 +2,15 @@
 # Minimal local PDF → (optional Tesseract OCR) → chunk → embed → retrieve top-N chunks
 # Returns: list[str] (chunk texts)
 
-import os, re, math, uuid, fitz, torch, faiss
+import os, re, math, uuid, hashlib, functools, multiprocessing, fitz, torch, faiss
+import numpy as np
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
 from transformers import AutoTokenizer, AutoModel
+from _atomic import atomic_path, write_atomic
 
 # Optional: Tesseract OCR
 try:
@@ -24,120 +29,302 @@ class Chunk:
 
 # ---------- OCR (Tesseract only) ----------
 class TesseractAdapter:
+    # LSTM engine only; pages are read as one uniform block of text
+    def __init__(self, lang: str = "eng", config: str = "--oem 1 --psm 6"):
+        self.lang = lang
+        self.config = config
+
     def run(self, image_path: str):
         if not TESS_AVAILABLE:
             raise RuntimeError("Tesseract not installed.")
-        img = Image.open(image_path)
-        text = pytesseract.image_to_string(img)
+        return self.run_image(Image.open(image_path))
+
+    def run_image(self, img: "Image.Image"):
+        if not TESS_AVAILABLE:
+            raise RuntimeError("Tesseract not installed.")
+        text = pytesseract.image_to_string(img, lang=self.lang, config=self.config)
         # Keep a uniform structure similar to prior code path
         return {"text": text, "blocks": [{"text": text, "bbox": [0, 0, img.width, img.height]}]}
 
 
 # ---------- PDF parsing ----------
+# Pages per worker below which a process pool costs more than it saves
+MIN_PAGES_PER_WORKER = 8
+
+
+def _extract_pages(
+    pdf_path: str, start: int, stop: int, dpi: int, ocr_params: Optional[tuple]
+) -> List[str]:
+    """
+    Worker entry point: text blocks of pages [start, stop). fitz documents can't be pickled,
+    so each worker opens the PDF itself and rebuilds the OCR adapter from its (lang, config).
+    """
+    ocr_adapter = TesseractAdapter(*ocr_params) if ocr_params else None
+    processor = PDFProcessor(ocr_adapter=ocr_adapter, dpi=dpi)
+    return processor.pages_to_text_blocks(pdf_path, range(start, stop))
+
+
 class PDFProcessor:
     def __init__(self, ocr_adapter: Optional[TesseractAdapter] = None, dpi: int = 220):
         self.ocr_adapter = ocr_adapter
         self.dpi = dpi
 
-    def pdf_to_text_blocks(self, pdf_path: str) -> List[str]:
+    def pdf_to_text_blocks(self, pdf_path: str, workers: Optional[int] = None) -> List[str]:
+        return list(self.iter_text_blocks(pdf_path, workers))
+
+    def iter_text_blocks(self, pdf_path: str, workers: Optional[int] = None) -> Iterator[str]:
+        """
+        Text blocks of the whole PDF in page order, yielded as pages (or worker page ranges) finish.
+        """
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        workers = min(workers or os.cpu_count() or 1, page_count // MIN_PAGES_PER_WORKER)
+        if workers <= 1:
+            yield from self.iter_page_blocks(pdf_path, range(page_count))
+            return
+
+        # Contiguous page ranges per worker (text extraction and OCR are CPU-bound), joined in page order
+        bounds = [page_count * k // workers for k in range(workers + 1)]
+        ocr = self.ocr_adapter
+        ocr_params = (ocr.lang, ocr.config) if ocr is not None else None
+        # spawned, not forked: by now the embedder has set up torch/tokenizer threads (maybe
+        # CUDA), which a forked child inherits in a broken state and can deadlock on
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            parts = pool.map(
+                _extract_pages,
+                [pdf_path] * workers,
+                bounds[:-1],
+                bounds[1:],
+                [self.dpi] * workers,
+                [ocr_params] * workers,
+            )
+            for part in parts:
+                yield from part
+
+    def pages_to_text_blocks(self, pdf_path: str, pages) -> List[str]:
+        return list(self.iter_page_blocks(pdf_path, pages))
+
+    def iter_page_blocks(self, pdf_path: str, pages) -> Iterator[str]:
         doc = fitz.open(pdf_path)
-        blocks_all: List[str] = []
-        img_dir = ".tmp_pdf_images"
-        if self.ocr_adapter:
-            os.makedirs(img_dir, exist_ok=True)
-
-        for i, page in enumerate(doc):
-            data = page.get_text("dict")
-            blocks = []
-            for b in data.get("blocks", []):
-                if b.get("type") == 0:
-                    txt = "".join(
-                        span.get("text", "")
-                        for line in b.get("lines", [])
-                        for span in line.get("spans", [])
-                    ).strip()
-                    if txt:
-                        blocks.append(txt)
-
-            # If the page looks text-poor and OCR is available, try OCR on the page image
-            if sum(len(t) for t in blocks) < 60 and self.ocr_adapter:
-                img_path = os.path.join(img_dir, f"page_{i+1}.png")
-                page.get_pixmap(dpi=self.dpi).save(img_path)
-                ocr = self.ocr_adapter.run(img_path)
-                if "blocks" in ocr:
-                    blocks = [b["text"] for b in ocr["blocks"] if b.get("text")]
-
-            blocks_all.extend(blocks)
-
-        return blocks_all
+
+        try:
+            for i in pages:
+                page = doc[i]
+                # (x0, y0, x1, y1, text, block_no, block_type) per block, without the span tree of "dict"
+                blocks = []
+                for *_bbox, text, _block_no, block_type in page.get_text("blocks"):
+                    if block_type == 0:
+                        txt = text.strip()
+                        if txt:
+                            blocks.append(txt)
+
+                # If the page looks text-poor and OCR is available, try OCR on the page image
+                if sum(len(t) for t in blocks) < 60 and self.ocr_adapter:
+                    # render straight into a PIL image; no PNG round-trip through disk
+                    pix = page.get_pixmap(dpi=self.dpi, alpha=False)
+                    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                    ocr = self.ocr_adapter.run_image(img)
+                    if "blocks" in ocr:
+                        blocks = [b["text"] for b in ocr["blocks"] if b.get("text")]
+
+                yield from blocks
+        finally:
+            doc.close()
 
 
 # ---------- Simple chunker ----------
-def chunk_texts(blocks: List[str], target_chars: int = 1000, overlap: int = 150) -> List[str]:
-    chunks, buf = [], []
+CHUNK_TARGET_CHARS = 1000
+CHUNK_OVERLAP = 150
+
+
+def chunk_texts(blocks: List[str], target_chars: int = CHUNK_TARGET_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return list(iter_chunks(blocks, target_chars, overlap))
+
+
+def iter_chunks(blocks: Iterable[str], target_chars: int = CHUNK_TARGET_CHARS, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Streaming chunk_texts: each chunk is yielded as soon as it is complete.
+    """
+    buf = []
     total = 0
     for b in blocks:
         if total + len(b) > target_chars and buf:
             text = "\n".join(buf)
-            chunks.append(text)
+            yield text
             tail = text[-overlap:] if overlap > 0 else ""
             buf = [tail] if tail else []
             total = len(tail)
         buf.append(b)
         total += len(b)
     if buf:
-        chunks.append("\n".join(buf))
-    return chunks
+        yield "\n".join(buf)
 
 
 # ---------- Embeddings ----------
 class HFEmbedder:
-    def __init__(self, model_name: str):
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    def __init__(self, model_name: str, batch_size: int = 32, compile_model: bool = True):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True, use_fast=True)
+        if not self.tokenizer.is_fast:
+            print(f"⚠️ No fast (Rust) tokenizer for {model_name}; tokenizing large PDFs will be slow.")
         self.model = AutoModel.from_pretrained(model_name, trust_remote_code=True)
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model.to(self.device)
+        # Half precision halves memory traffic on GPU: bf16 where supported (Ampere+), else fp16;
+        # pooling stays in fp32
+        if self.device == "cuda":
+            self.model.to(dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16)
         self.model.eval()
-        # infer dimension once
-        self.dim = self.encode(["test"]).shape[1]
-
-    @torch.no_grad()
-    def encode(self, texts: List[str]):
-        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=1024, return_tensors="pt")
-        enc = {k: v.to(self.device) for k, v in enc.items()}
-        out = self.model(**enc)
-        # mean-pool with mask
-        last_hidden = out[0]
-        mask = enc["attention_mask"].unsqueeze(-1).expand(last_hidden.size()).float()
-        pooled = (last_hidden * mask).sum(1) / torch.clamp(mask.sum(1), min=1e-9)
-        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
-        return pooled.cpu()
+        self.batch_size = batch_size
+
+        # Compiled forward on GPU; batches vary in length, hence dynamic shapes
+        eager_model = self.model
+        if compile_model and self.device == "cuda" and hasattr(torch, "compile"):
+            self.model = torch.compile(self.model, dynamic=True)
+        # infer dimension once (this also triggers compilation)
+        try:
+            self.dim = self.encode(["test"]).shape[1]
+        except Exception as e:
+            if self.model is eager_model:
+                raise
+            # e.g. no Triton backend on this platform
+            print(f"⚠️ torch.compile unavailable ({e}); using the eager model.")
+            self.model = eager_model
+            self.dim = self.encode(["test"]).shape[1]
+
+    @torch.inference_mode()
+    def encode(self, texts: List[str], batch_size: Optional[int] = None):
+        batch_size = batch_size or self.batch_size
+        enc = self.tokenizer(texts, padding=False, truncation=True, max_length=1024)
+        # Embed in micro-batches of similar length so each batch pads only to its own longest text
+        order = sorted(range(len(texts)), key=lambda i: len(enc["input_ids"][i]))
+        pooled_batches = []
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            batch = self.tokenizer.pad({k: [enc[k][i] for i in idx] for k in enc}, return_tensors="pt")
+            batch = {k: v.to(self.device) for k, v in batch.items()}
+            out = self.model(**batch)
+            # mean-pool with mask
+            last_hidden = out[0].float()
+            mask = batch["attention_mask"].unsqueeze(-1).expand(last_hidden.size()).float()
+            pooled = (last_hidden * mask).sum(1) / torch.clamp(mask.sum(1), min=1e-9)
+            pooled_batches.append(torch.nn.functional.normalize(pooled, p=2, dim=1).cpu())
+        # back to input order
+        pooled = torch.cat(pooled_batches)
+        result = torch.empty_like(pooled)
+        result[torch.tensor(order)] = pooled
+        return result
 
 
 # ---------- Core retriever ----------
+# Corpora with fewer chunks are searched exactly; above this an HNSW graph is built (and kept on disk)
+HNSW_MIN_CHUNKS = 1000
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 32
+# Chunks embedded per encode() call while a PDF streams through extraction
+EMBED_WINDOW = 256
+
+
 class LocalPDFRAGTool:
-    def __init__(self, embed_model: str = "Qwen/Qwen3-Embedding-0.6B", use_ocr: bool = True):
+    def __init__(self, embed_model: str = "Qwen/Qwen3-Embedding-0.6B", use_ocr: bool = True, cache_dir: str = ".rag_cache"):
+        self.embed_model = embed_model
         self.embedder = HFEmbedder(embed_model)
         self.ocr = TesseractAdapter() if (use_ocr and TESS_AVAILABLE) else None
         self.pdf = PDFProcessor(ocr_adapter=self.ocr)
+        # (chunks, vectors) per PDF, keyed by file content + everything that shapes them
+        self.cache_dir = cache_dir
+        self._question_vec = functools.lru_cache(maxsize=128)(self._encode_question)
+        self._index = (None, None)  # (corpus key, index) of the last search
+
+    def _cache_key(self, pdf_path: str) -> str:
+        h = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        h.update(f"|{self.embed_model}|{CHUNK_TARGET_CHARS}|{CHUNK_OVERLAP}|ocr={self.ocr and (self.ocr.lang, self.ocr.config)}".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    def _pdf_chunks(self, pdf_path: str):
+        """
+        Cache key, chunks and their embeddings for one PDF, from the cache when the same file was embedded before.
+        """
+        key = self._cache_key(pdf_path)
+        # vectors in the npz; the chunk texts in a JSON sidecar (a numpy str array would pad
+        # every chunk to the longest one)
+        cache_path = os.path.join(self.cache_dir, key + ".npz")
+        chunks_path = os.path.join(self.cache_dir, key + ".chunks.json")
+        if os.path.exists(cache_path) and os.path.exists(chunks_path):
+            with open(chunks_path, "rb") as f:
+                chunks = orjson.loads(f.read())
+            with np.load(cache_path) as data:
+                return key, chunks, data["vecs"]
+
+        # Embed windows of chunks while later pages are still being extracted; only the chunk
+        # texts and their vectors are kept, never every block or one corpus-sized batch
+        chunks: List[str] = []
+        vec_parts = [np.zeros((0, self.embedder.dim), dtype=np.float32)]
+        stream = iter_chunks(self.pdf.iter_text_blocks(pdf_path))
+        for window in iter(lambda: list(islice(stream, EMBED_WINDOW)), []):
+            chunks.extend(window)
+            vec_parts.append(self.embedder.encode(window).numpy())
+        vecs = np.concatenate(vec_parts)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(chunks_path, orjson.dumps(chunks))
+        with atomic_path(cache_path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(f, vecs=vecs)
+        return key, chunks, vecs
+
+    def _search_index(self, keys: List[str], vecs):
+        """
+        Exact inner-product index for small corpora; for large ones an HNSW graph, built once per
+        set of PDFs and reloaded from the cache afterwards. Vectors are L2-normalized, so IP == cosine.
+        """
+        if len(vecs) < HNSW_MIN_CHUNKS:
+            index = faiss.IndexFlatIP(self.embedder.dim)
+            index.add(vecs)
+            return index
+
+        corpus_key = hashlib.sha256("|".join(keys).encode("utf-8")).hexdigest()[:16]
+        if self._index[0] == corpus_key:
+            return self._index[1]
+        index_path = os.path.join(self.cache_dir, corpus_key + ".faiss")
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+        else:
+            index = faiss.IndexHNSWFlat(self.embedder.dim, HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.add(vecs)
+            with atomic_path(index_path) as tmp_path:
+                faiss.write_index(index, tmp_path)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        self._index = (corpus_key, index)
+        return index
+
+    def _encode_question(self, question: str):
+        return self.embedder.encode([question]).numpy()
 
     def forward(self, question: str, pdf_paths: List[str], top_n: int = 5) -> List[str]:
-        # 1. Extract + chunk all text
+        # 1. Extract + chunk + embed all text (cached per PDF)
         chunks: List[str] = []
+        keys, vecs = [], []
         for p in pdf_paths:
-            blocks = self.pdf.pdf_to_text_blocks(p)
-            chunks.extend(chunk_texts(blocks))
+            key, pdf_chunks, pdf_vecs = self._pdf_chunks(p)
+            keys.append(key)
+            chunks.extend(pdf_chunks)
+            vecs.append(pdf_vecs)
 
         if not chunks:
             return []
 
-        # 2. Embed all chunks + question
-        chunk_vecs = self.embedder.encode(chunks)
-        q_vec = self.embedder.encode([question])
+        # 2. Embed the question
+        chunk_vecs = np.concatenate(vecs)
+        q_vec = self._question_vec(question)
 
         # 3. Search top-N
-        index = faiss.IndexFlatIP(self.embedder.dim)
-        index.add(chunk_vecs.numpy())
-        D, I = index.search(q_vec.numpy(), min(top_n, len(chunks)))
+        index = self._search_index(keys, chunk_vecs)
+        D, I = index.search(q_vec, min(top_n, len(chunks)))
         top_texts = [chunks[i] for i in I[0] if i != -1]
         return top_texts
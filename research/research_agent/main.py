@@ -2,7 +2,10 @@
 
 import json
 import os
+import types
 
+from _executor import POOL
+from _http import HTTP2_AVAILABLE
 from adapter import KimiClientAdapter
 from arxiv_tool import ArxivTool
 from askclarification_tool import AskClarificationTool
@@ -11,7 +14,7 @@ from code_analysis_tool import CodeAnalysisTool
 from enhanced_final_answer_tool import Enhanced3Blue1BrownFinalAnswerTool
 from icon_generation_tool import IconGenerationTool
 from multi_tool_agent import GuardrailedMultiToolAgent
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 
 # Load API key (Kimi)
 try:
@@ -31,18 +34,29 @@ system_prompt = (
     "Constraints: One pass, no tool loops. Keep outputs concise; prefer clarity over flair.\n"
 )
 
+# Demo-mode stand-in for the model: always answers with the same minimal final JSON
+_MOCK_MSG = types.SimpleNamespace(
+    content="{\"explanation\":{\"content\":\"A short, clear explanation based on the provided results.\"},\"visual_brief\":[{\"concept\":\"Core Idea\",\"caption\":\"Simple visual to highlight the main relationship.\"}]}"
+)
+
+
+class MockAdapter:
+    def __init__(self, system_prompt): self.system_prompt = system_prompt
+    def __call__(self, messages, **kw): return _MOCK_MSG
+
+
 # Adapter
 try:
-    kimi = OpenAI(api_key=api_key, base_url="https://api.moonshot.cn/v1")
+    # the Step-1 tools call the model concurrently; with HTTP/2 they share one connection
+    kimi = OpenAI(
+        api_key=api_key,
+        base_url="https://api.moonshot.cn/v1",
+        http_client=DefaultHttpxClient(http2=HTTP2_AVAILABLE),
+    )
     adapter = KimiClientAdapter(kimi, system_prompt=system_prompt)
     print("✅ API client initialized")
 except Exception as e:
     print(f"⚠️ API init failed: {e}")
-    class MockAdapter:
-        def __init__(self, system_prompt): self.system_prompt = system_prompt
-        def __call__(self, messages, **kw):
-            class Msg: content = "{\"explanation\":{\"content\":\"A short, clear explanation based on the provided results.\"},\"visual_brief\":[{\"concept\":\"Core Idea\",\"caption\":\"Simple visual to highlight the main relationship.\"}]}"
-            return Msg()
     adapter = MockAdapter(system_prompt)
 
 # Tools
@@ -65,6 +79,9 @@ def display_welcome():
 
 def main():
     display_welcome()
+    # TCP/TLS setup to the API happens while the first question is typed, not on the first request
+    if hasattr(adapter, "warmup"):
+        POOL.submit(adapter.warmup)
     while True:
         q = input("\n💭 Enter your question (or 'quit'): ")
         if q.strip().lower() in {"quit", "exit", "q"}:
@@ -1,16 +1,131 @@
-import json
+import functools
 import os
 import re
+import threading
+import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+import orjson
+from _atomic import write_atomic
+from _executor import submit_in_context
+from arxiv_tool import QUERY_TOKEN, TIME_PHRASES, TIME_WORDS
+from tool_cache import get_or_compute
+
+# Step-1 analysis tools: independent of each other, only merged at final_answer
+STEP1_TOOLS = ("code_analysis", "sympy", "arxiv_search")
+
+# Final answers by model and normalized question, reused across runs for RESPONSE_TTL seconds (same
+# as arxiv results); at most MAX_RESPONSES, the oldest are dropped first
+RESPONSE_CACHE_PATH = ".response_cache.json"
+RESPONSE_TTL = 24 * 3600
+MAX_RESPONSES = 256
+QUESTION_SPACE = re.compile(r"\s+")
+
+# Final JSON of the latest query
+OUTPUT_DIR = "output"
+OUTPUT_PATH = os.path.join(OUTPUT_DIR, "latest_explanation.json")
+
+# Planning heuristics, compiled once instead of on every _build_plan call; the
+# case-insensitive ones run on the raw input, so it isn't lowercased per heuristic
+CODE_PATH = re.compile(r"Please analyze the code file '([^']+)'")
+MATH_SYMBOL = re.compile(r"[+\-/*^=]|∫|Σ|√|≈|≤|≥")
+MATH_SPAN = re.compile(r"[0-9\.\s\+\-\*/\^\(\)]+")
+ARITHMETIC_PREFIX = re.compile(r"^(what\s+is\s+|calculate\s+|compute\s+)", re.IGNORECASE)
+NON_ARITHMETIC_LETTER = re.compile(r"[a-df-hj-oq-rt-vx-z]", re.IGNORECASE)  # allow e, i, p loosely
+ARITHMETIC = re.compile(r"[\d\s()+\-*/^.]+")
+EXPLAIN_WITH = re.compile(
+    r"\b(explain|illustrate|visuali[sz]e|show|teach)\b.*\b(with|using)\b", re.IGNORECASE
+)
+EXPLAIN_WITH_WORD = re.compile(r"\bexplain\b\s+\bwith\b\s+\w+", re.IGNORECASE)
+ONLY_SYMBOLS = re.compile(r"[\W_]+")
+VOWEL = re.compile(r"[aeiouAEIOU]")
+SINGLE_WORD = re.compile(r"[a-zA-Z]{6,}")
+QUESTION_WORD = re.compile(r"(math|code|explain|what|why|how)", re.IGNORECASE)
+
+# Keyword categories, found by substring like `k in text.lower()`
+MATH_KEYWORD = 1
+THEORY_KEYWORD = 2
+ICON_KEYWORD = 4
+VISUAL_CUE = 8
+KEYWORDS = {
+    MATH_KEYWORD: [
+        "integrate", "differentiate", "solve", "simplify", "limit", "series",
+        "matrix", "determinant", "eigen", "gradient", "derivative", "converge", "proof"
+    ],
+    THEORY_KEYWORD: ["proof", "theorem", "convergence", "bound", "rate", "lower bound", "upper bound"],
+    ICON_KEYWORD: [
+        "icon", "icons", "diagram", "diagrams", "visual", "visuals",
+        "animation", "illustration", "figure", "figures",
+        "meme", "thumbnail", "sketch", "draw", "picture", "image", "graphic"
+    ],
+    VISUAL_CUE: [
+        "imagine", "picture", "see", "visual", "diagram", "arrow", "number line",
+        "area under", "vector", "slide", "stack", "highlight", "shade"
+    ],
+}
+
+
+def _keyword_table() -> dict:
+    """
+    keyword -> category bits. A keyword also carries the bits of every keyword it starts
+    with ("convergence" is also "converge"), since only the longest keyword is matched at
+    each position of the text.
+    """
+    table = {}
+    for bit, words in KEYWORDS.items():
+        for word in words:
+            table[word] = table.get(word, 0) | bit
+    bits = dict.fromkeys(table, 0)
+    for word in table:
+        for other, other_bits in table.items():
+            if word.startswith(other):
+                bits[word] |= other_bits
+    return bits
+
+
+KEYWORD_BITS = _keyword_table()
+# Zero-width lookahead so overlapping keywords ("rate" inside "integrate") are all seen
+KEYWORD = re.compile(
+    "(?=(" + "|".join(map(re.escape, sorted(KEYWORD_BITS, key=len, reverse=True))) + "))"
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _keyword_flags(text: str) -> int:
+    """
+    Category bits of all keywords in text: one lowercase and one scan, shared by the
+    heuristics that look at the same text.
+    """
+    flags = 0
+    for m in KEYWORD.finditer(text.lower()):
+        flags |= KEYWORD_BITS[m.group(1)]
+    return flags
+
+
+def _normalize_question(text: str) -> str:
+    # case, runs of whitespace and trailing punctuation don't change the question
+    return QUESTION_SPACE.sub(" ", text.lower()).strip(" ?!.")
 
 
-@dataclass
+def _is_time_sensitive(question: str) -> bool:
+    """
+    Questions about "latest"/"recent" work (the arxiv tool's time-focused queries) for a
+    normalized question; their answers go stale, so they are never reused.
+    """
+    return not TIME_WORDS.isdisjoint(QUERY_TOKEN.findall(question)) or any(
+        p in question for p in TIME_PHRASES
+    )
+
+
+@dataclass(frozen=True)
 class StepPlan:
     idx: int
     tool: str
     reason: str
     args: Optional[dict] = None
+    # idx of the steps whose outputs this step consumes; steps without any can start right away
+    deps: Tuple[int, ...] = ()
 
 
 class GuardrailedMultiToolAgent:
@@ -28,36 +143,74 @@ class GuardrailedMultiToolAgent:
                • final JSON (non-empty visual_brief, or visual language in explanation)
     """
 
-    def __init__(self, tools, model):
+    def __init__(self, tools, model, cache_path: Optional[str] = RESPONSE_CACHE_PATH):
         self.tool_map = {t.name: t for t in tools}
         self.model = model
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        # cache_path=None disables the response cache
+        self.cache_path = cache_path
+        self._cache_lock = threading.Lock()
+        self._responses = self._load_responses()
+
+    # ---------------- Response cache ----------------
+    def _load_responses(self) -> dict:
+        """
+        {"<model id>|<question>": {"result": ..., "time": ...}}, oldest first, without expired entries.
+        """
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, "rb") as f:
+                entries = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+        cutoff = time.time() - RESPONSE_TTL
+        return {
+            key: entry
+            for key, entry in entries.items()
+            if isinstance(entry, dict) and entry.get("time", 0) > cutoff
+        }
+
+    def _cached_response(self, key: str) -> Optional[str]:
+        entry = self._responses.get(key)
+        if entry is None or entry["time"] <= time.time() - RESPONSE_TTL:
+            return None
+        return entry["result"]
+
+    def _store_response(self, key: str, result: str):
+        with self._cache_lock:
+            # re-inserted at the end, so the dict stays ordered oldest first
+            self._responses.pop(key, None)
+            self._responses[key] = {"result": result, "time": time.time()}
+            while len(self._responses) > MAX_RESPONSES:
+                del self._responses[next(iter(self._responses))]
+            write_atomic(self.cache_path, orjson.dumps(self._responses))
 
     # ---------------- Heuristics ----------------
     @staticmethod
     def _extract_code_path(text: str) -> Optional[str]:
-        m = re.search(r"Please analyze the code file '([^']+)'", text)
+        m = CODE_PATH.search(text)
         return m.group(1) if m else None
 
     @staticmethod
     def _looks_like_math(text: str) -> bool:
-        math_keywords = [
-            "integrate", "differentiate", "solve", "simplify", "limit", "series",
-            "matrix", "determinant", "eigen", "gradient", "derivative", "converge", "proof"
-        ]
-        if any(k in text.lower() for k in math_keywords):
+        if _keyword_flags(text) & MATH_KEYWORD:
             return True
-        return bool(re.search(r"[+\-/*^=]|∫|Σ|√|≈|≤|≥", text))
+        return bool(MATH_SYMBOL.search(text))
 
     @staticmethod
     def _extract_math_expr(text: str) -> Optional[str]:
         """
-        Grab the longest mathy span from natural language (so SymPy doesn't choke).
+        Grab the longest mathy span (one with a digit) from natural language (so SymPy doesn't choke).
         """
-        m = re.findall(r"[0-9\.\s\+\-\*/\^\(\)]+", text)
-        if not m:
-            return None
-        candidate = max(m, key=len).strip()
-        return candidate if any(ch.isdigit() for ch in candidate) else None
+        best, best_len = None, 0
+        for m in MATH_SPAN.finditer(text):
+            span_len = m.end() - m.start()
+            if span_len > best_len:
+                span = m.group()
+                if any(ch.isdigit() for ch in span):
+                    best, best_len = span, span_len
+        return best.strip() if best else None
 
     @staticmethod
     def _is_trivial_arithmetic(text: str) -> bool:
@@ -65,31 +218,24 @@ class GuardrailedMultiToolAgent:
         True for small arithmetic queries like '2+3', 'what is 7*8?', '(2+3)^2?'
         i.e., mostly digits/operators, <= ~30 chars after stripping boilerplate.
         """
-        t = text.lower().strip()
-        t = re.sub(r"^(what\s+is\s+|calculate\s+|compute\s+)", "", t)
+        t = ARITHMETIC_PREFIX.sub("", text.strip())
         t = t.rstrip("?.! ")
         # If letters remain (beyond e, i, p), treat as non-trivial
-        if re.search(r"[a-df-hj-oq-rt-vx-z]", t):  # allow e, i, p loosely
+        if NON_ARITHMETIC_LETTER.search(t):
             return False
-        return bool(re.fullmatch(r"[\d\s()+\-*/^.]+", t)) and len(t) <= 30
+        return bool(ARITHMETIC.fullmatch(t)) and len(t) <= 30
 
     @staticmethod
     def _wants_icons_from_user(text: str) -> bool:
         """
         Explicit user requests for visuals.
         """
-        t = text.lower()
-        keyword_triggers = [
-            "icon", "icons", "diagram", "diagrams", "visual", "visuals",
-            "animation", "illustration", "figure", "figures",
-            "meme", "thumbnail", "sketch", "draw", "picture", "image", "graphic"
-        ]
-        if any(k in t for k in keyword_triggers):
+        if _keyword_flags(text) & ICON_KEYWORD:
             return True
         # Instructional phrasing like "explain with ___ / using ___ / show ___"
-        if re.search(r"\b(explain|illustrate|visuali[sz]e|show|teach)\b.*\b(with|using)\b", t):
+        if EXPLAIN_WITH.search(text):
             return True
-        if re.search(r"\bexplain\b\s+\bwith\b\s+\w+", t):
+        if EXPLAIN_WITH_WORD.search(text):
             return True
         return False
 
@@ -104,12 +250,8 @@ class GuardrailedMultiToolAgent:
         vb = payload.get("visual_brief", []) or []
         if isinstance(vb, list) and len(vb) > 0:
             return True
-        expl = ((payload.get("explanation") or {}).get("content") or "").lower()
-        visual_cues = [
-            "imagine", "picture", "see", "visual", "diagram", "arrow", "number line",
-            "area under", "vector", "slide", "stack", "highlight", "shade"
-        ]
-        return any(k in expl for k in visual_cues)
+        expl = (payload.get("explanation") or {}).get("content") or ""
+        return bool(_keyword_flags(expl) & VISUAL_CUE)
 
     @staticmethod
     def _needs_clarification(text: str) -> bool:
@@ -124,15 +266,15 @@ class GuardrailedMultiToolAgent:
             return True
 
         # Heuristic: mostly symbols without context
-        if re.fullmatch(r"[\W_]+", t):  # e.g. "!!!", "???", "///"
+        if ONLY_SYMBOLS.fullmatch(t):  # e.g. "!!!", "???", "///"
             return True
 
         # Looks like random gibberish (no vowels, weird character runs)
-        if not re.search(r"[aeiouAEIOU]", t) and len(t) > 6:
+        if not VOWEL.search(t) and len(t) > 6:
             return True
 
         # If it's only one nonsense word like "asdkjh" or "qwertyuiop"
-        if re.fullmatch(r"[a-zA-Z]{6,}", t) and not re.search(r"(math|code|explain|what|why|how)", t.lower()):
+        if SINGLE_WORD.fullmatch(t) and not QUESTION_WORD.search(t):
             return True
 
         return False
@@ -152,21 +294,26 @@ class GuardrailedMultiToolAgent:
         if trivial_math:
             return False
         if is_math:
-            theory_triggers = ["proof", "theorem", "convergence", "bound", "rate", "lower bound", "upper bound"]
-            return any(k in text.lower() for k in theory_triggers)
+            return bool(_keyword_flags(text) & THEORY_KEYWORD)
         # Non-math, non-code → ON by default
         return True
 
     # ---------------- Planning ----------------
-    def _build_plan(self, user_input: str) -> List[StepPlan]:
+    @classmethod
+    @functools.lru_cache(maxsize=128)
+    def _plan_steps(cls, user_input: str) -> Tuple[StepPlan, ...]:
+        """
+        The plan depends only on the question text, so a re-submitted question reuses it
+        (the steps are frozen and never mutated by run()).
+        """
         plan: List[StepPlan] = []
         i = 0
 
-        code_path = self._extract_code_path(user_input)
-        is_math = self._looks_like_math(user_input)
-        trivial_math = self._is_trivial_arithmetic(user_input)
-        wants_arxiv = self._needs_arxiv(user_input, is_math=is_math, code_path=code_path, trivial_math=trivial_math)
-        wants_clar = self._needs_clarification(user_input)
+        code_path = cls._extract_code_path(user_input)
+        is_math = cls._looks_like_math(user_input)
+        trivial_math = cls._is_trivial_arithmetic(user_input)
+        wants_arxiv = cls._needs_arxiv(user_input, is_math=is_math, code_path=code_path, trivial_math=trivial_math)
+        wants_clar = cls._needs_clarification(user_input)
 
         # Step 0: Clarification (only if crucial)
         if wants_clar:
@@ -187,7 +334,7 @@ class GuardrailedMultiToolAgent:
             i += 1
 
         if is_math:
-            expr = self._extract_math_expr(user_input) or user_input
+            expr = cls._extract_math_expr(user_input) or user_input
             plan.append(StepPlan(
                 idx=i, tool="sympy",
                 reason="Math-like query; verify/compute with SymPy.",
@@ -207,19 +354,25 @@ class GuardrailedMultiToolAgent:
         plan.append(StepPlan(
             idx=i, tool="final_answer",
             reason="Synthesize 3Blue1Brown-style explanation (100–250 words) + visual_brief.",
-            args={}
+            args={},
+            deps=tuple(p.idx for p in plan if p.tool in STEP1_TOOLS),
         ))
         i += 1
 
         # NOTE: We DO NOT pre-add icon_generation here; we decide after final_answer.
+        return tuple(plan)
+
+    def _build_plan(self, user_input: str) -> List[StepPlan]:
+        plan = list(self._plan_steps(user_input))
 
-        # ---- Print ONE definitive plan (YES/NO per tool) ----
-        print("\n🧭 EXECUTION PLAN (decided before running):")
+        # ---- Print ONE definitive plan (YES/NO per tool), collected into a single write ----
+        lines = ["\n🧭 EXECUTION PLAN (decided before running):"]
+        planned = {p.tool for p in plan}
         flags = {
-            "ask_clarification": wants_clar,
-            "code_analysis": bool(code_path),
-            "sympy": bool(is_math),
-            "arxiv_search": bool(wants_arxiv),
+            "ask_clarification": "ask_clarification" in planned,
+            "code_analysis": "code_analysis" in planned,
+            "sympy": "sympy" in planned,
+            "arxiv_search": "arxiv_search" in planned,
             "final_answer": True,
             "icon_generation": "TBD (decide after final_answer)",
         }
@@ -230,128 +383,213 @@ class GuardrailedMultiToolAgent:
             else:
                 mark = "✅" if enabled else "❌"
                 note = ""
-            print(f"  {mark} {name}" + (f" — {note}" if note else ""))
+            lines.append(f"  {mark} {name}" + (f" — {note}" if note else ""))
 
-        print("\n📋 ORDERED STEPS:")
+        lines.append("\n📋 ORDERED STEPS:")
         for p in plan:
-            print(f"  • {p.tool}: {p.reason}")
+            lines.append(f"  • {p.tool}: {p.reason}")
             if p.args:
                 arg_preview = {k: (v if isinstance(v, (int, float, bool)) else str(v)) for k, v in p.args.items()}
                 if arg_preview:
-                    print(f"    args: {arg_preview}")
+                    lines.append(f"    args: {arg_preview}")
+        print("\n".join(lines))
 
         return plan
 
     # ---------------- Runner ----------------
-    def run(self, user_input: str) -> str:
-        plan = self._build_plan(user_input)
-
-        combined_result_snippets: List[str] = []
-        final_payload = None
+    def _call_step1(self, p: StepPlan):
+        """
+        Run one Step-1 tool; the exception is returned (not raised) so one failing tool
+        doesn't cancel the others.
+        """
+        tool = self.tool_map[p.tool]
+        try:
+            if p.tool == "code_analysis":
+                # its model call is cached by llm_cache, keyed on the file contents
+                return tool.forward(p.args["file_path"], p.args["question"])
+            if p.tool == "sympy":
+                return get_or_compute(p.tool, p.args, lambda: tool.forward(p.args["expression"]))
+            return get_or_compute(
+                p.tool, p.args,
+                lambda: tool.forward(p.args["query"], p.args["max_results"], p.args["debug"]),
+            )
+        except Exception as e:
+            return e
 
+    @staticmethod
+    def _levels(plan: List[StepPlan]) -> List[List[StepPlan]]:
+        """
+        Group the steps by dependency depth: a step's level is one past its deepest dep, so
+        every step of a level only needs outputs of earlier levels.
+        """
+        depth = {}
+        for p in plan:  # deps always point at earlier steps
+            depth[p.idx] = 1 + max((depth[d] for d in p.deps), default=-1)
+        levels = [[] for _ in range(max(depth.values(), default=-1) + 1)]
         for p in plan:
-            tool = self.tool_map.get(p.tool)
-            if not tool:
-                return f"⚠️ Unknown tool '{p.tool}'. Available: {list(self.tool_map.keys())}"
-
-            try:
-                if p.tool == "ask_clarification":
-                    followup = tool.forward(p.args["prompt"])
-                    print("\n✅ Clarification check done." + (f" Needs: {followup}" if followup else " No extra info required."))
-                    continue
-
-                if p.tool == "code_analysis":
-                    out = tool.forward(p.args["file_path"], p.args["question"])
-                    print("\n💻 Code analysis output:\n" + str(out))
-                    combined_result_snippets.append(f"[code_analysis]\n{out}")
-                    continue
-
-                if p.tool == "sympy":
-                    out = tool.forward(p.args["expression"])
-                    print("\n🔢 SymPy output:\n" + str(out))
-                    combined_result_snippets.append(f"[sympy]\n{out}")
-                    continue
-
-                if p.tool == "arxiv_search":
-                    out = tool.forward(p.args["query"], p.args["max_results"], p.args["debug"])
-                    print("\n📚 ArXiv search output:\n" + str(out))
-                    combined_result_snippets.append(f"[arxiv]\n{out}")
-                    continue
-
-                if p.tool == "final_answer":
-                    fa = self.tool_map["final_answer"]
-                    context_blob = "\n\n".join(combined_result_snippets).strip()
-                    result_str = fa.forward(question=user_input, result=context_blob)
-                    os.makedirs("output", exist_ok=True)
-                    try:
-                        final_payload = json.loads(result_str)
-                    except Exception:
-                        final_payload = {
-                            "question": user_input,
-                            "explanation": {"content": result_str},
-                            "visual_brief": [],
-                            "visual_assets": {"icons": []},
-                        }
-                    final_payload.setdefault("visual_brief", [])
-                    final_payload.setdefault("visual_assets", {}).setdefault("icons", [])
-                    with open("output/latest_explanation.json", "w", encoding="utf-8") as f:
-                        f.write(json.dumps(final_payload, indent=2, ensure_ascii=False))
-                    print("\n🧾 Final explanation (with visual_brief) created.")
-                    print("\n🧾 Final JSON snapshot:\n" + json.dumps(final_payload, indent=2, ensure_ascii=False))
-
-                    # -------- Decide icons AFTER final answer --------
-                    user_wants = self._wants_icons_from_user(user_input)
-                    final_wants = self._wants_icons_from_final(final_payload)
-                    should_icons = user_wants or final_wants
-                    print("\n🎛️ Icon decision:")
-                    print(f"  • user_wants_icons: {user_wants}")
-                    print(f"  • final_wants_icons: {final_wants}")
-                    print(f"  • => will_run_icon_generation: {should_icons}")
-
-                    if should_icons and "icon_generation" in self.tool_map:
-                        tool = self.tool_map["icon_generation"]
-                        vb = final_payload.get("visual_brief", []) or []
-                        concepts_payload = (
-                            json.dumps({"visual_brief": vb}, ensure_ascii=False)
-                            if vb else final_payload.get("explanation", {}).get("content", "")
-                        )
-                        context = final_payload.get("explanation", {}).get("content", "") or user_input
-                        icons_json = tool.forward(concepts=concepts_payload, style=None, context=context)
-
-                        print("\n🎨 Icon generation raw output:\n" + str(icons_json))
-
-                        icons_payload = []
-                        try:
-                            data = json.loads(icons_json)
-                            for icon in data.get("generated_icons", []):
-                                icons_payload.append({
-                                    "concept": icon.get("concept", ""),
-                                    "path": icon.get("filename", "")
-                                })
-                        except Exception:
-                            pass
-
-                        # ✅ Merge icons into existing payload instead of overwriting
-                        if "visual_assets" not in final_payload:
-                            final_payload["visual_assets"] = {}
-                        final_payload["visual_assets"]["icons"] = icons_payload
+            levels[depth[p.idx]].append(p)
+        return levels
 
-                        # Save full JSON (preserving question, explanation, visual_brief, etc.)
-                        with open("output/latest_explanation.json", "w", encoding="utf-8") as f:
-                            json.dump(final_payload, f, indent=2, ensure_ascii=False)
-
-                        print("\n🎨 Icons merged into output/latest_explanation.json")
+    def _start_level(self, level: List[StepPlan]) -> dict:
+        """
+        Submit the level's Step-1 tools to the pool together (they are network/LLM-bound), so
+        they take as long as the slowest one instead of the sum, and overlap with the steps of
+        the level that run in the caller (Step 0). Returns {step idx: future of output or exception}.
+        """
+        return {
+            p.idx: submit_in_context(self._call_step1, p)
+            for p in level
+            if p.tool in STEP1_TOOLS and p.tool in self.tool_map
+        }
 
+    def run(self, user_input: str) -> str:
+        # Answers about a code file depend on the file's current contents, and answers about
+        # the latest research go stale, so neither is reused
+        cache_key = None
+        if self.cache_path and not self._extract_code_path(user_input):
+            question = _normalize_question(user_input)
+            if not _is_time_sensitive(question):
+                # answers from one model are not served after switching to another
+                model_id = getattr(self.model, "model_id", type(self.model).__name__)
+                cache_key = f"{model_id}|{question}"
+        if cache_key is not None:
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                print("\n♻️ Same question answered before; reusing the final answer.")
+                snapshot = orjson.dumps(orjson.loads(cached), option=orjson.OPT_INDENT_2)
+                print("\n🧾 Final JSON snapshot:\n" + snapshot.decode())
+                write_atomic(OUTPUT_PATH, snapshot)
+                return cached
 
-                    continue
+        plan = self._build_plan(user_input)
 
-            except Exception as e:
-                print(f"\n❌ Error in step '{p.tool}': {e}")
-                combined_result_snippets.append(f"[{p.tool} ERROR] {e}")
+        # step idx -> output snippet, read by the steps that depend on it
+        step_outputs = {}
+        final_payload = None
+        failed = False
+
+        for level in self._levels(plan):
+            futures = self._start_level(level)
+            for p in level:
+                tool = self.tool_map.get(p.tool)
+                if not tool:
+                    return f"⚠️ Unknown tool '{p.tool}'. Available: {list(self.tool_map.keys())}"
+
+                try:
+                    if p.tool in STEP1_TOOLS:
+                        out = futures[p.idx].result()
+                        if isinstance(out, Exception):
+                            raise out
+
+                    if p.tool == "ask_clarification":
+                        followup = tool.forward(p.args["prompt"])
+                        print("\n✅ Clarification check done." + (f" Needs: {followup}" if followup else " No extra info required."))
+                        continue
+
+                    if p.tool == "code_analysis":
+                        print("\n💻 Code analysis output:\n" + str(out))
+                        step_outputs[p.idx] = f"[code_analysis]\n{out}"
+                        continue
+
+                    if p.tool == "sympy":
+                        print("\n🔢 SymPy output:\n" + str(out))
+                        step_outputs[p.idx] = f"[sympy]\n{out}"
+                        continue
+
+                    if p.tool == "arxiv_search":
+                        print("\n📚 ArXiv search output:\n" + str(out))
+                        step_outputs[p.idx] = f"[arxiv]\n{out}"
+                        continue
+
+                    if p.tool == "final_answer":
+                        fa = self.tool_map["final_answer"]
+                        # only what it depends on, in plan order
+                        context_blob = "\n\n".join(
+                            step_outputs[d] for d in p.deps if d in step_outputs
+                        ).strip()
+                        result_str = fa.forward(question=user_input, result=context_blob)
+                        try:
+                            final_payload = orjson.loads(result_str)
+                        except Exception:
+                            final_payload = {
+                                "question": user_input,
+                                "explanation": {"content": result_str},
+                                "visual_brief": [],
+                                "visual_assets": {"icons": []},
+                            }
+                        final_payload.setdefault("visual_brief", [])
+                        final_payload.setdefault("visual_assets", {}).setdefault("icons", [])
+                        # serialized once for both the console and (unless icons get merged in) the file
+                        snapshot = orjson.dumps(final_payload, option=orjson.OPT_INDENT_2)
+                        print("\n🧾 Final explanation (with visual_brief) created.")
+                        print("\n🧾 Final JSON snapshot:\n" + snapshot.decode())
+
+                        # -------- Decide icons AFTER final answer --------
+                        user_wants = self._wants_icons_from_user(user_input)
+                        final_wants = self._wants_icons_from_final(final_payload)
+                        should_icons = user_wants or final_wants
+                        print("\n🎛️ Icon decision:")
+                        print(f"  • user_wants_icons: {user_wants}")
+                        print(f"  • final_wants_icons: {final_wants}")
+                        print(f"  • => will_run_icon_generation: {should_icons}")
+
+                        # One write per query, after the icon step (also if it fails)
+                        try:
+                            if should_icons and "icon_generation" in self.tool_map:
+                                tool = self.tool_map["icon_generation"]
+                                vb = final_payload.get("visual_brief", []) or []
+                                # the tool takes the visual_brief dict as is, no JSON round-trip
+                                concepts_payload = (
+                                    {"visual_brief": vb}
+                                    if vb else final_payload.get("explanation", {}).get("content", "")
+                                )
+                                context = final_payload.get("explanation", {}).get("content", "") or user_input
+                                icons_json = tool.forward(concepts=concepts_payload, style=None, context=context)
+
+                                print("\n🎨 Icon generation raw output:\n" + str(icons_json))
+
+                                icons_payload = []
+                                try:
+                                    data = orjson.loads(icons_json)
+                                    for icon in data.get("generated_icons", []):
+                                        icons_payload.append({
+                                            "concept": icon.get("concept", ""),
+                                            "path": icon.get("filename", "")
+                                        })
+                                except Exception:
+                                    pass
+
+                                # ✅ Merge icons into existing payload instead of overwriting
+                                if "visual_assets" not in final_payload:
+                                    final_payload["visual_assets"] = {}
+                                final_payload["visual_assets"]["icons"] = icons_payload
+
+                                # Save full JSON (preserving question, explanation, visual_brief, etc.)
+                                snapshot = orjson.dumps(final_payload, option=orjson.OPT_INDENT_2)
+                                print(f"\n🎨 Icons merged into {OUTPUT_PATH}")
+                        finally:
+                            write_atomic(OUTPUT_PATH, snapshot)
+
+
+                        continue
+
+                except Exception as e:
+                    print(f"\n❌ Error in step '{p.tool}': {e}")
+                    step_outputs[p.idx] = f"[{p.tool} ERROR] {e}"
+                    failed = True
+
+        # an answer built around a failed step isn't replayed; the next run retries the tools
+        if final_payload is not None and cache_key is not None and not failed:
+            result = orjson.dumps(final_payload).decode()
+            try:
+                self._store_response(cache_key, result)
+            except OSError as e:
+                print(f"\n⚠️ Could not update the response cache: {e}")
+            return result
 
-        return json.dumps(final_payload or {
+        return orjson.dumps(final_payload or {
             "question": user_input,
             "explanation": {"content": "No explanation produced."},
             "visual_brief": [],
             "visual_assets": {"icons": []}
-        }, ensure_ascii=False)
+        }).decode()
@@ -1,8 +1,53 @@
 import json
+import os
 import re
+import shutil
 
+from _atomic import atomic_path, write_atomic
 from smolagents.agents import ChatMessage
 
+# Planner output: <tool name="...">args</tool>, and the key="value" arguments inside it
+TOOL_CALL = re.compile(r'<tool name="([^\"]+)">(.*?)</tool>', re.DOTALL)
+QUERY_ARG = re.compile(r'query="([^"]+)"')
+MAX_RESULTS_ARG = re.compile(r"max_results=(\d+)")
+FILE_PATH_ARG = re.compile(r'file_path="([^"]+)"')
+QUESTION_ARG = re.compile(r'question="([^"]+)"')
+TITLE_ARG = re.compile(r'title="([^"]+)"')
+VISUAL_STYLE_ARG = re.compile(r'visual_style="([^"]+)"')
+CONTENT_ARG = re.compile(r'content="""(.*?)"""', re.DOTALL)
+
+# Tools that may run only once per question (a repeat call is redirected)
+ONE_OFF_TOOLS = frozenset(
+    {"arxiv_search", "sympy", "code_analysis", "final_answer", "icon_generation"}
+)
+
+# The explanation JSON and its backup copy
+EXPLANATION_PATH = "latest_explanation.json"
+BACKUP_PATH = "latest_explanation_backup.json"
+
+
+def _save_explanation(text: str, label: str):
+    """
+    Write the serialized JSON once and make the backup a hard link to it (a copy where links
+    aren't supported). The file is replaced rather than rewritten in place, so the link
+    never sees a later, partial write.
+    """
+    try:
+        write_atomic(EXPLANATION_PATH, text.encode("utf-8"))
+        print(f"\n📁 {label} JSON saved to '{EXPLANATION_PATH}'")
+    except Exception as e:
+        print(f"\n⚠️ Failed to save {label.lower()} JSON to {EXPLANATION_PATH}: {e}")
+        return
+    try:
+        with atomic_path(BACKUP_PATH) as tmp_path:
+            try:
+                os.link(EXPLANATION_PATH, tmp_path)
+            except OSError:
+                shutil.copyfile(EXPLANATION_PATH, tmp_path)
+        print(f"\n📁 {label} JSON saved to '{BACKUP_PATH}'")
+    except Exception as e:
+        print(f"\n⚠️ Failed to save {label.lower()} JSON to {BACKUP_PATH}: {e}")
+
 
 class MultiToolAgent:
     """
@@ -37,37 +82,19 @@ class MultiToolAgent:
             print(f"\n🔍 Plan:\n{plan}")
 
             # Parse tool invocation
-            tool_match = re.search(
-                r'<tool name="([^\"]+)">(.*?)</tool>', plan, re.DOTALL
-            )
+            tool_match = TOOL_CALL.search(plan)
             if not tool_match:
                 # Fallback: save raw content and exit
                 fallback = {"content": plan}
-                for fname in [
-                    "latest_explanation.json",
-                    "latest_explanation_backup.json",
-                ]:
-                    try:
-                        with open(fname, "w", encoding="utf-8") as f:
-                            json.dump(fallback, f, indent=2, ensure_ascii=False)
-                        print(f"\n📁 Fallback JSON saved to '{fname}'")
-                    except Exception as e:
-                        print(f"\n⚠️ Failed to save fallback JSON to {fname}: {e}")
+                _save_explanation(json.dumps(fallback, indent=2, ensure_ascii=False), "Fallback")
                 return plan
 
             tool_name, args = tool_match.group(1), tool_match.group(2).strip()
 
             # Prevent loops: one-off tools only once
-            one_off_tools = [
-                "arxiv_search",
-                "sympy",
-                "code_analysis",
-                "final_answer",
-                "icon_generation",
-            ]
             if (
                 last_output
-                and tool_name in one_off_tools
+                and tool_name in ONE_OFF_TOOLS
                 and tool_name in tool_execution_history
             ):
                 # After final_answer, force icon_generation
@@ -109,8 +136,8 @@ class MultiToolAgent:
 
                 # Research
                 elif tool_name == "arxiv_search":
-                    q_m = re.search(r'query="([^"]+)"', args)
-                    r_m = re.search(r"max_results=(\d+)", args)
+                    q_m = QUERY_ARG.search(args)
+                    r_m = MAX_RESULTS_ARG.search(args)
                     query = q_m.group(1) if q_m else args
                     max_r = int(r_m.group(1)) if r_m else 5
                     result = tool.forward(query, max_r, False)
@@ -120,8 +147,8 @@ class MultiToolAgent:
 
                 # Code analysis
                 elif tool_name == "code_analysis":
-                    fp = re.search(r'file_path="([^"]+)"', args)
-                    qs = re.search(r'question="([^"]+)"', args)
+                    fp = FILE_PATH_ARG.search(args)
+                    qs = QUESTION_ARG.search(args)
                     if fp and qs:
                         file_path, question = fp.group(1), qs.group(1)
                     else:
@@ -158,25 +185,16 @@ class MultiToolAgent:
                         prev_json["icons"] = icon_data
                         final = json.dumps(prev_json, ensure_ascii=False)
                         # Save both JSON files
-                        for fname in [
-                            "latest_explanation.json",
-                            "latest_explanation_backup.json",
-                        ]:
-                            try:
-                                with open(fname, "w", encoding="utf-8") as f:
-                                    f.write(final)
-                                print(f"\n📁 Final JSON saved to '{fname}'")
-                            except Exception as e:
-                                print(f"\n⚠️ Failed to save final JSON to {fname}: {e}")
+                        _save_explanation(final, "Final")
                         return final
                     continue
 
                 # Final answer: produce JSON without icons yet
                 elif tool_name == "final_answer":
                     # Extract fields
-                    ttl = re.search(r'title="([^"]+)"', args)
-                    vst = re.search(r'visual_style="([^"]+)"', args)
-                    cnt = re.search(r'content="""(.*?)"""', args, re.DOTALL)
+                    ttl = TITLE_ARG.search(args)
+                    vst = VISUAL_STYLE_ARG.search(args)
+                    cnt = CONTENT_ARG.search(args)
                     output = {
                         "title": ttl.group(1) if ttl else "",
                         "visual_style": vst.group(1) if vst else None,
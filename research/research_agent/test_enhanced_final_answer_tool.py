@@ -0,0 +1,31 @@
+# test_enhanced_final_answer_tool.py
+# The plain-text fallback must parse bullets like the original line-by-line parser:
+# [ln.strip("-* ").strip() for ln in raw.splitlines() if ln.strip().startswith(("-", "*"))]
+
+from enhanced_final_answer_tool import _bullet_brief
+
+
+def test_crlf_bullets():
+    raw = "Intro\r\n- Vector: an arrow\r\n- Span\r\n* Basis: minimal set\r\n- Extra: ignored\r\n"
+    assert _bullet_brief(raw) == [
+        {"concept": "Vector", "caption": " an arrow"},
+        {"concept": "Span", "caption": "Span"},
+        {"concept": "Basis", "caption": " minimal set"},
+    ]
+
+
+def test_tab_indented_bullets():
+    raw = "Intro\n\t- Vector: an arrow\n \t* Span\t\n\t\t-Basis :minimal set\t\n"
+    assert _bullet_brief(raw) == [
+        {"concept": "- Vector", "caption": " an arrow"},
+        {"concept": "* Span", "caption": "* Span"},
+        {"concept": "-Basis ", "caption": "minimal set"},
+    ]
+
+
+def test_bare_cr_line_endings_and_limits():
+    raw = "Intro\r- " + "c" * 50 + ":" + "d" * 90 + "\r- a:\rnot a bullet"
+    assert _bullet_brief(raw) == [
+        {"concept": "c" * 40, "caption": "d" * 80},
+        {"concept": "a", "caption": "a:"},
+    ]
@@ -0,0 +1,48 @@
+# tool_cache.py
+# Result cache for tool calls keyed by (tool, arguments): one JSON file per key under
+# ./.tool_cache/<tool>/, expired by file age, so repeat questions skip the HTTP/compute work.
+
+import hashlib
+import json
+import os
+import time
+
+from _atomic import write_atomic
+
+CACHE_DIR = ".tool_cache"
+
+# Seconds a cached result stays valid per tool (None: forever); tools not listed aren't cached
+TOOL_TTL = {
+    "arxiv_search": 24 * 3600,  # new submissions show up daily
+    "sympy": None,  # deterministic
+}
+
+
+def _cache_key(tool_name: str, args: dict) -> str:
+    blob = json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(
+        f"{tool_name}\x00{blob}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def get_or_compute(tool_name: str, args: dict, compute):
+    """
+    Return the cached result of tool_name(**args) if there is a fresh one, otherwise
+    compute() and store its (string) result. Exceptions from compute() are not cached.
+    """
+    if tool_name not in TOOL_TTL:
+        return compute()
+    ttl = TOOL_TTL[tool_name]
+    path = os.path.join(CACHE_DIR, tool_name, _cache_key(tool_name, args) + ".json")
+    try:
+        if ttl is None or time.time() - os.path.getmtime(path) < ttl:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["result"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = compute()
+    if isinstance(result, str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, json.dumps({"result": result}, ensure_ascii=False).encode("utf-8"))
+    return result